@@ -0,0 +1,183 @@
+import json
+import re
+from pathlib import Path
+from typing import Iterator
+
+CHUNK_SIZE = 1 << 16
+WHITESPACE = " \t\r\n"
+YEAR_PATTERN = re.compile(r"\b\d{4}\b")
+KEYWORD_SEPARATOR_PATTERN = re.compile(r"[,;]")
+DOI_PREFIX_PATTERN = re.compile(
+    r"^(https?://(dx\.)?doi\.org/|doi:\s*)", re.IGNORECASE)
+
+
+def iter_records(path: str | Path) -> Iterator[dict]:
+    """Yield the records of a CSL-JSON file one at a time
+
+    Both a top-level JSON array and JSON Lines are accepted. The file is
+    read in fixed size chunks, so memory use does not grow with its size.
+    """
+
+    with open(path, "r", encoding="utf-8") as file:
+        first = _peek(file)
+        if first == "[":
+            yield from _iter_array(file)
+        elif first:
+            yield from _iter_lines(file)
+
+
+def _peek(file) -> str:
+    """Return the first non-whitespace character and rewind to it"""
+
+    while True:
+        position = file.tell()
+        char = file.read(1)
+        if char not in WHITESPACE or char == "":
+            file.seek(position)
+            return char
+
+
+def _iter_lines(file) -> Iterator[dict]:
+    for number, line in enumerate(file, start=1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield json.loads(line)
+        except json.JSONDecodeError as error:
+            raise ValueError(f"Invalid JSON on line {number}: {error}")
+
+
+def _iter_array(file) -> Iterator[dict]:
+    decoder = json.JSONDecoder()
+    buffer = file.read(CHUNK_SIZE).lstrip(WHITESPACE)[1:]
+    position = 0
+    chunk_size = CHUNK_SIZE
+    eof = False
+
+    while True:
+        while position < len(buffer) and buffer[position] in WHITESPACE + ",":
+            position += 1
+
+        if position < len(buffer) and buffer[position] == "]":
+            return
+
+        try:
+            record, end = decoder.raw_decode(buffer, position)
+        except json.JSONDecodeError as error:
+            if eof:
+                raise ValueError(f"Invalid CSL-JSON array: {error}")
+
+            chunk = file.read(chunk_size)
+            if chunk:
+                # A record larger than a chunk would be re-decoded once per
+                # chunk, so grow the reads until it fits.
+                chunk_size = min(chunk_size * 2, CHUNK_SIZE << 8)
+            else:
+                eof = True
+            buffer = buffer[position:] + chunk
+            position = 0
+            continue
+
+        chunk_size = CHUNK_SIZE
+        position = end
+        yield record
+
+        if position > CHUNK_SIZE:
+            buffer = buffer[position:]
+            position = 0
+
+
+def get_authors(data: dict) -> list[dict]:
+    """Return the authors of a record as family/given name pairs
+
+    Names only given as a literal are split at the last space.
+    """
+
+    authors = []
+    for name in data.get("author") or []:
+        family = _strip(name.get("family"))
+        given = _strip(name.get("given"))
+
+        if family is None and name.get("literal"):
+            given, _, family = name["literal"].strip().rpartition(" ")
+            given = given or None
+
+        authors.append({"family": family, "given": given})
+
+    return authors
+
+
+def get_year(data: dict) -> int | None:
+    """Return the issue year of a record"""
+
+    issued = data.get("issued") or {}
+    try:
+        return int(issued["date-parts"][0][0])
+    except (KeyError, IndexError, TypeError, ValueError):
+        pass
+
+    match = YEAR_PATTERN.search(str(issued.get("raw") or
+                                    issued.get("literal") or ""))
+    return int(match.group()) if match else None
+
+
+def get_publisher(data: dict) -> dict | None:
+    """Return the publisher of a record as a dict, if it has one"""
+
+    publisher = data.get("publisher")
+    if isinstance(publisher, str):
+        publisher = {"name": publisher}
+
+    if not publisher or not _strip(publisher.get("name")):
+        return None
+
+    return {**publisher, "name": _strip(publisher["name"])}
+
+
+def get_tags(data: dict) -> list[str]:
+    """Return the keywords of a record as tags
+
+    CSL keeps keywords in a single string, separated by commas or
+    semicolons; a list of keywords is accepted as well.
+    """
+
+    keywords = data.get("keyword") or []
+    if isinstance(keywords, str):
+        keywords = KEYWORD_SEPARATOR_PATTERN.split(keywords)
+
+    return clean_tags(keywords)
+
+
+def clean_tags(tags: list[str]) -> list[str]:
+    """Lowercase tags, collapse their spaces and drop duplicates"""
+
+    cleaned: dict[str, None] = {}
+    for tag in tags:
+        tag = " ".join(str(tag).lower().split())
+        if tag:
+            cleaned[tag] = None
+
+    return list(cleaned)
+
+
+def clean_isbn(isbn: str | None) -> str | None:
+    """Keep only the first of the ISBNs listed in a record"""
+
+    isbns = (isbn or "").replace(",", " ").split()
+    return isbns[0] if isbns else None
+
+
+def clean_doi(doi: str | None) -> str | None:
+    """Strip resolver URLs and prefixes from a DOI"""
+
+    doi = _strip(doi)
+    if not doi:
+        return None
+    return DOI_PREFIX_PATTERN.sub("", doi)
+
+
+def _strip(value: str | None) -> str | None:
+    if value is None:
+        return None
+    return value.strip() or None
@@ -0,0 +1,98 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from itertools import islice
+from pathlib import Path
+from typing import Any, AsyncIterator, Callable, Coroutine, Iterator
+from .base import ConnectionPool, DatabaseConnector
+from .cache import EntityCache, QueryCache
+from .handler import DBHandler
+from ..domain import Author, Document, Publisher
+
+
+class AsyncDBHandler:
+    """Coroutine version of every public DBHandler method
+
+    The iter_* methods are async generators instead, which fetch each
+    batch on the thread pool.
+
+    Calls run on a dedicated thread pool with as many threads as the
+    connection pool has readers, so each thread effectively owns a reader
+    connection and lookups never wait on each other or block the event
+    loop. Writes still go through the single writer connection.
+
+        async with AsyncDBHandler() as handler:
+            books, papers = await asyncio.gather(handler.get_books(),
+                                                 handler.get_papers())
+    """
+
+    def __init__(self, path: str | Path | None = None, max_workers: int = 8,
+                 profile: str = "serving", cache: EntityCache | None = None,
+                 query_cache: QueryCache | None = None):
+        self.pool = ConnectionPool(path or DatabaseConnector.DB_PATH,
+                                   readers=max_workers, profile=profile)
+        self.handler = DBHandler(self.pool, cache, query_cache)
+        self._executor = ThreadPoolExecutor(
+            max_workers, thread_name_prefix="fsa-db")
+
+    async def _run(self, method: Callable, *args, **kwargs) -> Any:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._executor, partial(method, *args, **kwargs))
+
+    def __getattr__(self, name: str) -> Callable[..., Coroutine]:
+        method = getattr(self.handler, name)
+        if name.startswith("_") or not callable(method):
+            raise AttributeError(name)
+
+        async def run(*args, **kwargs) -> Any:
+            return await self._run(method, *args, **kwargs)
+
+        run.__name__ = name
+        run.__doc__ = method.__doc__
+        return run
+
+    async def _iterate(self, iterator: Iterator,
+                       batch_size: int) -> AsyncIterator:
+        """Drive a DBHandler iterator on the thread pool, a batch at a time
+
+        Each batch runs at most one query of the iterator, so the event
+        loop only hands out items that were already fetched.
+        """
+
+        while batch := await self._run(list, islice(iterator, batch_size)):
+            for item in batch:
+                yield item
+
+    def iter_documents(self, filters: dict | None = None,
+                       batch_size: int = 1000) -> AsyncIterator[Document]:
+        """Iterate over all documents, keeping one page in memory"""
+
+        return self._iterate(
+            self.handler.iter_documents(filters, batch_size), batch_size)
+
+    def iter_authors(self, batch_size: int = 1000) -> AsyncIterator[Author]:
+        """Iterate over all authors, keeping one batch in memory"""
+
+        return self._iterate(self.handler.iter_authors(batch_size),
+                             batch_size)
+
+    def iter_publishers(self, batch_size: int = 1000
+                        ) -> AsyncIterator[Publisher]:
+        """Iterate over all publishers, keeping one batch in memory"""
+
+        return self._iterate(self.handler.iter_publishers(batch_size),
+                             batch_size)
+
+    async def close(self) -> None:
+        """Wait for running calls, then close every connection"""
+
+        await asyncio.get_running_loop().run_in_executor(
+            None, self._executor.shutdown)
+        self.pool.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, ctx_type, ctx_value, ctx_traceback):
+        await self.close()
@@ -1,93 +1,272 @@
+import atexit
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator
+from .migrations import migrate
 
 Connection = sqlite3.Connection
 
+# Pragmas set on every connection, by profile. "safe" keeps SQLite's
+# rollback journal with full syncs; "serving" lets readers run alongside a
+# writer; "bulk-load" gives imports a larger cache and memory map. The WAL
+# profiles sync only at checkpoints, so an OS crash or power loss can undo
+# the last commits but leaves the database intact.
+PROFILES: dict[str, dict[str, str | int]] = {
+    "safe": {
+        "journal_mode": "DELETE",
+        "synchronous": "FULL",
+        "cache_size": -2000,
+        "mmap_size": 0,
+        "temp_store": "DEFAULT",
+        "busy_timeout": 5000,
+    },
+    "serving": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -65536,
+        "mmap_size": 268435456,
+        "temp_store": "MEMORY",
+        "busy_timeout": 5000,
+    },
+    "bulk-load": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "cache_size": -262144,
+        "mmap_size": 1073741824,
+        "temp_store": "MEMORY",
+        "busy_timeout": 30000,
+    },
+}
+DEFAULT_PROFILE = "safe"
+
+
+def get_profile_name() -> str:
+    """Return the configured profile, DatabaseConnector.PROFILE first,
+    then the FSA_DB_PROFILE environment variable"""
+
+    return (DatabaseConnector.PROFILE or os.environ.get("FSA_DB_PROFILE")
+            or DEFAULT_PROFILE)
+
+
+def apply_profile(con: Connection, name: str) -> None:
+    """Set the pragmas of a performance profile on a connection"""
+
+    if name not in PROFILES:
+        raise ValueError(f"Unknown database profile '{name}'.")
+
+    pragmas = dict(PROFILES[name])
+
+    # First, so the pragmas that need a lock wait for it instead of failing.
+    con.execute(f"PRAGMA busy_timeout = {pragmas.pop('busy_timeout')}")
+    set_journal_mode(con, str(pragmas.pop("journal_mode")))
+
+    for pragma, value in pragmas.items():
+        con.execute(f"PRAGMA {pragma} = {value}")
+
+
+def set_journal_mode(con: Connection, mode: str) -> None:
+    """Switch the journal mode of the database, if nothing prevents it
+
+    Unlike the other pragmas, the journal mode belongs to the database
+    file and outlasts the connection. It is only changed when it differs,
+    and kept as it is while other open connections keep it from changing,
+    e.g. a "serving" pool holding the database in WAL mode.
+    """
+
+    current = con.execute("PRAGMA journal_mode").fetchone()[0]
+    if current.upper() == mode.upper():
+        return None
+
+    try:
+        con.execute(f"PRAGMA journal_mode = {mode}")
+    except sqlite3.OperationalError:
+        pass
+
+
+def connect(path: str | Path, profile: str | None = None,
+            uri: bool = False) -> Connection:
+    """Open a connection configured like every other one in the archive"""
+
+    con = sqlite3.connect(path, check_same_thread=False, uri=uri)
+    con.row_factory = sqlite3.Row
+    apply_profile(con, profile or get_profile_name())
+    return con
+
+
+class ConnectionManager:
+    """Process-wide owner of the connections to each database file
+
+    A connection is opened and its schema validated the first time a
+    file is requested; afterwards every caller gets the same connection.
+    """
+
+    _connections: dict[Path, Connection] = {}
+    _lock = threading.Lock()
+
+    @classmethod
+    def get_connection(cls, path: str | Path) -> Connection:
+        path = Path(path).resolve()
+
+        with cls._lock:
+            con = cls._connections.get(path)
+            if con is None:
+                con = connect(path)
+                DatabaseConnector.create_tables(con)
+                cls._connections[path] = con
+
+        return con
+
+    @classmethod
+    def close_all(cls) -> None:
+        with cls._lock:
+            for con in cls._connections.values():
+                con.execute("PRAGMA optimize")
+                con.close()
+            cls._connections.clear()
+
+
+atexit.register(ConnectionManager.close_all)
+
+
+class SharedConnection:
+    """Reader/writer interface over a single connection
+
+    Lets code written against ConnectionPool run on one connection, where
+    reads and writes share it.
+    """
+
+    def __init__(self, con: Connection):
+        self.con = con
+        self._writer_lock = threading.RLock()
+
+    @contextmanager
+    def reader(self) -> Iterator[Connection]:
+        yield self.con
+
+    @contextmanager
+    def writer(self) -> Iterator[Connection]:
+        with self._writer_lock:
+            yield self.con
+
+    def data_version(self) -> tuple[int, int] | None:
+        """Identify the committed contents of the database
+
+        PRAGMA data_version moves when another connection commits and
+        total_changes when this one writes. None while a transaction is
+        open, as reads on this connection then see its uncommitted
+        changes.
+        """
+
+        if self.con.in_transaction:
+            return None
+        version = self.con.execute("PRAGMA data_version").fetchone()[0]
+        return version, self.con.total_changes
+
+
+class ConnectionPool:
+    """Thread-safe pool of read-only connections plus one writer
+
+    Readers are opened on demand up to `readers` and handed to one thread
+    at a time, so lookups run in parallel. Every write goes through the
+    single writer connection, one thread at a time. Readers only run
+    alongside the writer under a WAL profile, hence the "serving" default.
+    """
+
+    def __init__(self, path: str | Path, readers: int = 8,
+                 profile: str = "serving"):
+        self.path = Path(path).resolve()
+        self.size = readers
+        self.profile = profile
+
+        self._writer = connect(self.path, profile)
+        DatabaseConnector.create_tables(self._writer)
+        self._writer_lock = threading.RLock()
+
+        self._idle: queue.LifoQueue[Connection] = queue.LifoQueue()
+        self._readers: list[Connection] = []
+        self._lock = threading.Lock()
+
+        # Only ever asked for PRAGMA data_version, so it never waits for
+        # the writer and its version counts the writer's commits too.
+        self._monitor = self._open_reader()
+        self._monitor_lock = threading.Lock()
+
+    def _open_reader(self) -> Connection:
+        con = connect(f"{self.path.as_uri()}?mode=ro", self.profile, uri=True)
+        con.execute("PRAGMA query_only = 1")
+        return con
+
+    @contextmanager
+    def reader(self) -> Iterator[Connection]:
+        """Borrow a read-only connection, waiting if all are in use"""
+
+        try:
+            con = self._idle.get_nowait()
+        except queue.Empty:
+            con = None
+            with self._lock:
+                if len(self._readers) < self.size:
+                    con = self._open_reader()
+                    self._readers.append(con)
+            if con is None:
+                con = self._idle.get()
+
+        try:
+            yield con
+        finally:
+            if con.in_transaction:
+                con.rollback()
+            self._idle.put(con)
+
+    @contextmanager
+    def writer(self) -> Iterator[Connection]:
+        """Hold the writer connection for the duration of the block"""
+
+        with self._writer_lock:
+            yield self._writer
+
+    def data_version(self) -> int:
+        """Identify the committed contents of the database
+
+        Moves whenever any other connection commits, the pool's writer
+        and other processes included.
+        """
+
+        with self._monitor_lock:
+            rows = self._monitor.execute("PRAGMA data_version")
+            return rows.fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock, self._writer_lock, self._monitor_lock:
+            for con in self._readers:
+                con.close()
+            self._readers.clear()
+            self._monitor.close()
+            self._writer.execute("PRAGMA optimize")
+            self._writer.close()
+
 
 class DatabaseConnector:
     DB_PATH: Path = Path("fsa.db")
+    PROFILE: str | None = None
 
     def __init__(self):
-        self.con = sqlite3.connect(self.DB_PATH)
-        self.con.row_factory = sqlite3.Row
-        DatabaseConnector.create_tables(self.con)
+        self.con = ConnectionManager.get_connection(self.DB_PATH)
 
     def __enter__(self):
         return self.con
 
     def __exit__(self, ctx_type, ctx_value, ctx_traceback):
-        self.con.close()
+        # The connection outlives this block, so work left uncommitted is
+        # discarded here, as closing the connection used to do.
+        if self.con.in_transaction:
+            self.con.rollback()
 
     @staticmethod
     def create_tables(con) -> None:
-        cur = con.cursor()
         con.execute("PRAGMA foreign_keys = 1")
-        cur.execute("""CREATE TABLE IF NOT EXISTS Publisher (
-                        publisher_id INTEGER PRIMARY KEY,
-                        name TEXT NOT NULL UNIQUE,
-                        address TEXT,
-                        url TEXT,
-                        created_at DATE
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS User (
-                        user_id INTEGER PRIMARY KEY,
-                        username TEXT NOT NULL UNIQUE,
-                        password TEXT NOT NULL,
-                        email TEXT NOT NULL UNIQUE,
-                        date_joined DATE
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Document (
-                        document_id INTEGER PRIMARY KEY,
-                        title TEXT NOT NULL,
-                        language TEXT,
-                        year INTEGER,
-                        publisher_id INTEGER,
-                        created_at DATE,
-                        type TEXT CHECK(type IN ('book', 'paper')),
-                        user_id INTEGER,
-                        UNIQUE(title, year)
-                        FOREIGN KEY (publisher_id) REFERENCES Publisher (publisher_id)
-                            ON DELETE SET NULL
-                        FOREIGN KEY (user_id) REFERENCES User (user_id)
-                            ON DELETE SET NULL
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Book (
-                        document_id INTEGER PRIMARY KEY,
-                        isbn TEXT UNIQUE,
-                        edition TEXT,
-                        publication_place TEXT,
-                        FOREIGN KEY (document_id) REFERENCES Document (document_id)
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Paper (
-                        document_id INTEGER PRIMARY KEY,
-                        doi TEXT UNIQUE,
-                        journal TEXT,
-                        issue TEXT,
-                        pages TEXT,
-                        volume TEXT,
-                        FOREIGN KEY (document_id) REFERENCES Document (document_id)
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Author (
-                        author_id INTEGER PRIMARY KEY,
-                        last_name TEXT,
-                        remaining_name TEXT,
-                        birth_date DATE,
-                        email TEXT,
-                        social_url TEXT,
-                        nationality TEXT,
-                        created_at DATE,
-                        UNIQUE(last_name, remaining_name)
-                        )""")
-
-        cur.execute("""CREATE TABLE IF NOT EXISTS Writes (
-                        document_id INTEGER,
-                        author_id INTEGER,
-                        PRIMARY KEY (document_id, author_id)
-                        FOREIGN KEY (document_id) REFERENCES Document (document_id),
-                        FOREIGN KEY (author_id) REFERENCES Author (author_id)
-                        )""")
+        migrate(con)
@@ -0,0 +1,134 @@
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable, Iterable
+
+
+class EntityCache:
+    """Bounded LRU identity map of entities, keyed by kind and id
+
+    Kinds are "document", "author" and "publisher". Ids are converted
+    with int(), so one given as a string, e.g. straight from input(),
+    finds and evicts the same entry as the int id. Every invalidation
+    bumps `generation`; a reader takes it before querying and passes it to
+    put(), so a row read before a write commits is never cached after the
+    write has invalidated it.
+    """
+
+    def __init__(self, maxsize: int = 10000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self._entities: OrderedDict[tuple[str, int], Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, kind: str, id: int) -> Any | None:
+        """Return a cached entity, or None on a miss"""
+
+        key = (kind, int(id))
+        with self._lock:
+            entity = self._entities.get(key)
+            if entity is None:
+                self.misses += 1
+                return None
+
+            self._entities.move_to_end(key)
+            self.hits += 1
+            return entity
+
+    def put(self, kind: str, id: int, entity: Any,
+            generation: int | None = None) -> None:
+        """Cache an entity read while the cache was at `generation`"""
+
+        key = (kind, int(id))
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return None
+
+            self._entities[key] = entity
+            self._entities.move_to_end(key)
+            while len(self._entities) > self.maxsize:
+                self._entities.popitem(last=False)
+
+    def invalidate(self, keys: Iterable[tuple[str, int]]) -> None:
+        """Drop entities that a write changed"""
+
+        with self._lock:
+            self.generation += 1
+            for kind, id in keys:
+                self._entities.pop((kind, int(id)), None)
+
+    def clear(self) -> None:
+        """Drop every entity, e.g. after writes made outside DBHandler"""
+
+        with self._lock:
+            self.generation += 1
+            self._entities.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entities)
+
+
+class QueryCache:
+    """Bounded LRU cache of query results, tied to a database version
+
+    The version is whatever identifies the database contents to the
+    caller, e.g. PRAGMA data_version with the connection's total_changes.
+    Results are only served while it is unchanged, so writes from other
+    connections and processes are picked up on the next lookup.
+    """
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.version: Any = None
+        self._results: OrderedDict[Hashable, Any] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version: Any) -> Any | None:
+        """Return a cached result, or None if missing or out of date"""
+
+        with self._lock:
+            if version != self.version:
+                self.version = version
+                self._results.clear()
+
+            result = self._results.get(key)
+            if result is None:
+                self.misses += 1
+                return None
+
+            self._results.move_to_end(key)
+            self.hits += 1
+            return result
+
+    def put(self, key: Hashable, version: Any, result: Any) -> None:
+        """Cache a result computed at `version`"""
+
+        with self._lock:
+            if version != self.version:
+                return None
+
+            self._results[key] = result
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.version = None
+            self._results.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def __len__(self) -> int:
+        return len(self._results)
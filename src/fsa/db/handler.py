@@ -1,329 +1,765 @@
+import copy
+import json
 import sqlite3
 import traceback
-from ..domain import Paper, Author, Publisher, Book, Document, User
+from contextlib import contextmanager
+from functools import partial, wraps
+from typing import Any, Callable, Iterable, Iterator
+from .base import Connection, ConnectionPool, SharedConnection
+from .cache import EntityCache, QueryCache
+from .lazy import BatchLoader
+from .migrations import STAT_COLUMNS
+from . import mapping
+from ..csl import clean_tags
+from ..domain import (Paper, Author, Publisher, Book, Document, User,
+                      SearchResult, DocumentTitle, AuthorName, PublisherName)
 
 Cursor = sqlite3.Cursor
 
+# What DBHandler.stats() counts documents by. Publishers and authors are
+# keyed by id.
+STAT_DIMENSIONS = (*STAT_COLUMNS, "author")
+
+DOCUMENT_FILTERS = {
+    "type": "Document.type = ?",
+    "year": "Document.year = ?",
+    "user_id": "Document.user_id = ?",
+    "publisher": "Publisher.name = ?",
+    "author": """Document.document_id IN (
+                     SELECT Writes.document_id
+                     FROM Author
+                     INNER JOIN Writes
+                         ON Writes.author_id = Author.author_id
+                     WHERE Author.last_name = ?)""",
+    "tags_any": """Document.document_id IN (
+                       SELECT DocumentTag.document_id
+                       FROM Tag
+                       INNER JOIN DocumentTag
+                           ON DocumentTag.tag_id = Tag.tag_id
+                       WHERE Tag.name IN (SELECT value FROM json_each(?)))""",
+    # Walks the links of the rarest tag and probes those of the others.
+    "tags_all": """Document.document_id IN (
+                       SELECT DocumentTag.document_id
+                       FROM DocumentTag
+                       WHERE DocumentTag.tag_id = (
+                           SELECT tag_id FROM Tag
+                           WHERE name IN (SELECT value FROM json_each(?))
+                           ORDER BY document_count
+                           LIMIT 1)
+                       AND NOT EXISTS (
+                           SELECT 1 FROM json_each(?) AS wanted
+                           LEFT JOIN Tag
+                               ON Tag.name = wanted.value
+                           LEFT JOIN DocumentTag AS other
+                               ON other.tag_id = Tag.tag_id
+                               AND other.document_id = DocumentTag.document_id
+                           WHERE other.document_id IS NULL))""",
+}
+
+
+def cached_query(method: Callable) -> Callable:
+    """Serve a read from the handler's QueryCache while nothing changed"""
+
+    @wraps(method)
+    def cached(self, *args, **kwargs):
+        if self.query_cache is None:
+            return method(self, *args, **kwargs)
+
+        version = self.pool.data_version()
+        if version is None:
+            return method(self, *args, **kwargs)
+
+        key = (method.__name__, repr(args), repr(sorted(kwargs.items())))
+        result = self.query_cache.get(key, version)
+        if result is None:
+            result = method(self, *args, **kwargs)
+            self.query_cache.put(key, version, result)
+
+        return copy.copy(result)
+
+    return cached
+
+
+def _row_maker(projection: type) -> Callable:
+    """Row factory building a namedtuple straight from the cursor"""
+
+    return lambda cur, row: projection._make(row)
+
+
+def _tuples(con: Connection) -> Cursor:
+    """A cursor returning plain tuples, for rows read by position"""
+
+    cur = con.cursor()
+    cur.row_factory = None
+    return cur
+
+
+def _decode(encoded: dict[int, str], read: Callable,
+            document_ids: list[int]) -> dict[int, list]:
+    """Decode the JSON arrays of DocumentView columns for many documents"""
+
+    return {document_id: [read(item)
+                          for item in json.loads(encoded[document_id])]
+            for document_id in document_ids}
+
 
 class DBHandler:
+    """Queries of the archive
+
+    Accepts either a single connection or a ConnectionPool. Reads run on
+    a reader connection and writes on the writer connection, each write
+    method in one transaction; with a single connection both are the same.
+
+    With an EntityCache, documents, authors and publishers looked up by id
+    are served from memory until a write through a handler sharing that
+    cache changes them. Writes made elsewhere, such as bulk imports, need
+    a cache.clear().
+
+    With a QueryCache, list, aggregate and search results are reused
+    until the database changes, whichever connection or process wrote.
+    """
+
+    def __init__(self, con: Connection | ConnectionPool,
+                 cache: EntityCache | None = None,
+                 query_cache: QueryCache | None = None):
+        if isinstance(con, ConnectionPool):
+            self.pool = con
+        else:
+            self.pool = SharedConnection(con)
+
+        self.cache = cache
+        self.query_cache = query_cache
+        self._stale: list[tuple[str, int]] = []
+
+    @contextmanager
+    def _transaction(self) -> Iterator[Cursor]:
+        """Run a block in a write transaction on the writer connection"""
+
+        with self.pool.writer() as con:
+            cur = con.cursor()
+            if con.in_transaction:
+                # The caller owns the transaction, so evict right away.
+                try:
+                    yield cur
+                finally:
+                    self._evict_stale()
+                return
+
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                yield cur
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+            finally:
+                self._evict_stale()
 
-    def __init__(self, con):
-        self.con = con
+    def _evict_stale(self) -> None:
+        if self._stale:
+            self.cache.invalidate(self._stale)
+            self._stale = []
 
-    def insert_user(self, user: User) -> int:
-        """Insert a new user into the database"""
+    def _invalidate(self, kind: str, ids: Iterable[int | None]) -> None:
+        """Evict entities from the cache once the transaction ends"""
 
-        cur = self.con.cursor()
+        if self.cache is not None:
+            self._stale += [(kind, id) for id in ids if id is not None]
 
-        cur.execute("""
-                    INSERT OR IGNORE INTO User
-                    VALUES(:user_id, :username, :password, :email, 
-                    :date_joined)
-                    """, user.get_parsed_dict())
+    def _linked_ids(self, cur: Cursor, query: str, id: int) -> list[int]:
+        """Ids whose cached entities embed the one being written"""
 
-        self.con.commit()
+        if self.cache is None:
+            return []
+        return [row[0] for row in cur.execute(query, (id,))]
 
-        res = cur.execute("""
-                        SELECT user_id FROM User
-                        WHERE username = ?
-                        """, (user.username,))
+    def insert_user(self, user: User) -> int:
+        """Insert a new user into the database"""
 
-        return res.fetchone()[0]
+        with self._transaction() as cur:
+            res = cur.execute("""
+                              INSERT INTO User
+                              VALUES(?, ?, ?, ?, ?)
+                              ON CONFLICT(username)
+                                  DO UPDATE SET username = excluded.username
+                              ON CONFLICT DO NOTHING
+                              RETURNING user_id
+                              """, mapping.USER.params(user))
 
-    def insert_publisher(self, publisher: Publisher) -> int:
-        """Insert a new publisher into the database"""
+            row = res.fetchone()
 
-        cur = self.con.cursor()
+        if row is None:
+            raise ValueError("This email is already in use.")
 
-        cur.execute("""
-                    INSERT OR IGNORE INTO Publisher
-                    VALUES(:publisher_id, :name, :address, :url, :created_at)
-                    """, publisher.get_parsed_dict())
+        return row[0]
+
+    def insert_publisher(self, publisher: Publisher,
+                         cur: Cursor | None = None) -> int:
+        """Insert a new publisher into the database"""
 
-        self.con.commit()
+        if cur is None:
+            with self._transaction() as cur:
+                return self.insert_publisher(publisher, cur)
 
         res = cur.execute("""
-                        SELECT publisher_id FROM Publisher
-                        WHERE name = ?
-                        """, (publisher.name,))
+                          INSERT INTO Publisher
+                          VALUES(?, ?, ?, ?, ?)
+                          ON CONFLICT(name)
+                              DO UPDATE SET name = excluded.name
+                          RETURNING publisher_id
+                          """, mapping.PUBLISHER.params(publisher))
 
         return res.fetchone()[0]
 
     def insert_author(self, author: Author, cur: Cursor | None = None) -> int:
         """Insert a new author into the database"""
 
-        commit = False
-        if not cur:
-            commit = True
-            cur = self.con.cursor()
+        if cur is None:
+            with self._transaction() as cur:
+                return self.insert_author(author, cur)
 
-        try:
-            cur.execute("""
-                        INSERT INTO Author
-                        VALUES(:author_id, :last_name, :remaining_name, 
-                        :birth_date, :email, :social_url, :nationality,
-                        :created_at)
-                        """, author.get_parsed_dict())
-            author_id = cur.lastrowid
+        res = cur.execute("""
+                          INSERT INTO Author
+                          VALUES(?, ?, ?, ?, ?, ?, ?, ?)
+                          ON CONFLICT(last_name, remaining_name)
+                              DO UPDATE SET last_name = excluded.last_name
+                          RETURNING author_id
+                          """, mapping.AUTHOR.params(author))
 
-            if commit:
-                self.con.commit()
+        return res.fetchone()[0]
 
-        except sqlite3.IntegrityError:
-            print("This Author already exists.")
+    def link_author(self, author_id: int, document_id: int,
+                    cur: Cursor | None = None) -> None:
+        """Link an author to a document"""
 
-            res = cur.execute("""
-                            SELECT author_id FROM Author
-                            WHERE last_name = ? AND remaining_name = ?
-                            """, (author.last_name, author.remaining_name))
+        if cur is None:
+            try:
+                with self._transaction() as cur:
+                    return self.link_author(author_id, document_id, cur)
+            except sqlite3.IntegrityError:
+                print("This author or document does not exist.")
+                return None
 
-            author_id = res.fetchone()[0]
+        cur.execute("""
+                    INSERT INTO Writes (document_id, author_id)
+                    VALUES(?, ?)
+                    ON CONFLICT DO NOTHING
+                    """, (document_id, author_id))
 
-        return author_id
+        self._invalidate("author", [author_id])
+        self._invalidate("document", [document_id])
 
-    def link_author(self, author_id: int, document_id: int,
-                    cur: Cursor | None = None) -> None:
-        """Link an author to a document"""
+    def tag_document(self, document_id: int, tags: list[str],
+                     cur: Cursor | None = None) -> None:
+        """Add tags to a document, creating the tags that are new"""
 
-        commit = False
         if cur is None:
-            commit = True
-            cur = self.con.cursor()
+            try:
+                with self._transaction() as cur:
+                    return self.tag_document(document_id, tags, cur)
+            except sqlite3.IntegrityError:
+                print("This document does not exist.")
+                return None
 
-        try:
-            cur.execute("""
-                        INSERT INTO Writes VALUES(?, ?)
-                        """, (document_id, author_id))
+        names = json.dumps(clean_tags(tags))
 
-            if commit:
-                self.con.commit()
-        except sqlite3.IntegrityError:
-            print("This author is already linked to this document.")
-            print(traceback.format_exc())
+        cur.execute("""
+                    INSERT INTO Tag (name)
+                    SELECT value FROM json_each(?)
+                    WHERE true
+                    ON CONFLICT(name) DO NOTHING
+                    """, (names,))
 
-    def _insert_document(self, parsed_document: dict, type: str,
-                         user_id: int, cur: Cursor) -> tuple[bool, int]:
-        """Insert a new document into the database"""
+        cur.execute("""
+                    INSERT INTO DocumentTag (document_id, tag_id, source)
+                    SELECT ?, tag_id, 'user' FROM Tag
+                    WHERE name IN (SELECT value FROM json_each(?))
+                    ON CONFLICT DO UPDATE SET source = 'user'
+                    """, (document_id, names))
 
-        parsed_document.update({"type": type})
-        parsed_document.update({"user_id": user_id})
+        self._invalidate("document", [document_id])
 
-        try:
+    def untag_document(self, document_id: int, tags: list[str]) -> None:
+        """Remove tags from a document"""
+
+        with self._transaction() as cur:
             cur.execute("""
-                        INSERT INTO Document
-                        VALUES(:document_id, :title, :language, :year, 
-                        :publisher_id, :created_at, :type, :user_id)
-                        """, parsed_document)
+                        DELETE FROM DocumentTag
+                        WHERE document_id = ?
+                        AND tag_id IN (
+                            SELECT tag_id FROM Tag
+                            WHERE name IN (SELECT value FROM json_each(?)))
+                        """, (document_id, json.dumps(clean_tags(tags))))
 
-            document_id = cur.lastrowid
-            success = True
-        except sqlite3.IntegrityError:
-            print("This Document already exists.")
+            self._invalidate("document", [document_id])
 
-            res = cur.execute("""
-                        SELECT document_id FROM Document
-                        WHERE title = ? AND year = ?
-                        """, (parsed_document.get("title"),
-                              parsed_document.get("year")))
+    def _insert_document(self, document: Document, type: str,
+                         publisher_id: int | None, user_id: int,
+                         cur: Cursor) -> tuple[bool, int]:
+        """Insert a new document into the database"""
 
-            document_id = res.fetchone()[0]
-            success = False
+        res = cur.execute(f"""
+                          INSERT INTO Document
+                          ({", ".join(mapping.DOCUMENT.fields)},
+                          publisher_id, type, user_id)
+                          VALUES({mapping.DOCUMENT.placeholders}, ?, ?, ?)
+                          ON CONFLICT(title, year) DO NOTHING
+                          RETURNING document_id
+                          """, (*mapping.DOCUMENT.params(document),
+                                publisher_id, type, user_id))
+
+        row = res.fetchone()
+        if row is not None:
+            return True, row[0]
+
+        # Only an already stored document needs a lookup for its id.
+        res = cur.execute("""
+                          SELECT document_id FROM Document
+                          WHERE title = ? AND year = ?
+                          """, (document.title, document.year))
 
-        return success, document_id
+        return False, res.fetchone()[0]
 
     def insert_paper(self, paper: Paper, user_id: int) -> int:
         """Insert a new paper into the database"""
 
-        if paper.publisher:
-            publisher_id = self.insert_publisher(paper.publisher)
-        else:
-            publisher_id = None
-
-        parsed_paper = paper.get_parsed_dict()
-        parsed_paper.update({"publisher_id": publisher_id})
+        with self._transaction() as cur:
+            if paper.publisher:
+                publisher_id = self.insert_publisher(paper.publisher, cur)
+            else:
+                publisher_id = None
 
-        self.con.isolation_level = None
-        cur = self.con.cursor()
-        cur.execute("BEGIN")
-        success, document_id = self._insert_document(
-            parsed_paper, "paper", user_id, cur)
+            success, document_id = self._insert_document(
+                paper, "paper", publisher_id, user_id, cur)
 
-        if not success:
-            return document_id
+            if not success:
+                return document_id
 
-        parsed_paper.update({"document_id": document_id})
+            paper.document_id = document_id
+            self._invalidate("publisher", [publisher_id])
 
-        cur.execute("""
-                    INSERT INTO Paper
-                    VALUES(:document_id, :doi, :journal, :issue, :pages, 
-                    :volume)
-                    """, parsed_paper)
+            cur.execute("""
+                        INSERT INTO Paper
+                        VALUES(?, ?, ?, ?, ?, ?)
+                        """, mapping.PAPER.params(paper))
 
-        if paper.publisher:
-            for author in paper.authors:
+            for author in paper.authors or []:
                 author_id = self.insert_author(author, cur)
                 self.link_author(author_id, document_id, cur)
 
-        self.con.commit()
+            self.tag_document(document_id, paper.tags, cur)
 
         return document_id
 
     def insert_book(self, book: Book, user_id: int) -> int:
         """Insert a new book into the database"""
 
-        if book.publisher:
-            publisher_id = self.insert_publisher(book.publisher)
-        else:
-            publisher_id = None
-
-        parsed_book = book.get_parsed_dict()
-        parsed_book.update({"publisher_id": publisher_id})
+        with self._transaction() as cur:
+            if book.publisher:
+                publisher_id = self.insert_publisher(book.publisher, cur)
+            else:
+                publisher_id = None
 
-        self.con.isolation_level = None
-        cur = self.con.cursor()
-        cur.execute("BEGIN")
-        success, document_id = self._insert_document(
-            parsed_book, "book", user_id, cur)
+            success, document_id = self._insert_document(
+                book, "book", publisher_id, user_id, cur)
 
-        if not success:
-            return document_id
+            if not success:
+                return document_id
 
-        parsed_book.update({"document_id": document_id})
+            book.document_id = document_id
+            self._invalidate("publisher", [publisher_id])
 
-        cur.execute("""
-                    INSERT INTO Book
-                    VALUES(:document_id, :isbn, :edition, :publication_place)
-                    """, parsed_book)
+            cur.execute("""
+                        INSERT INTO Book
+                        VALUES(?, ?, ?, ?)
+                        """, mapping.BOOK.params(book))
 
-        if book.publisher:
-            for author in book.authors:
+            for author in book.authors or []:
                 author_id = self.insert_author(author, cur)
                 self.link_author(author_id, document_id, cur)
 
-        self.con.commit()
+            self.tag_document(document_id, book.tags, cur)
 
         return document_id
 
     def set_document_publisher(self, document_id: int, publisher_id: int) -> None:
         """Update the publisher of a document"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        UPDATE Document
-                        SET publisher_id = ?
-                        WHERE document_id = ?
-                        """, (publisher_id, document_id))
+            with self._transaction() as cur:
+                self._invalidate("publisher", self._linked_ids(cur, """
+                    SELECT publisher_id FROM Document
+                    WHERE document_id = ?
+                    """, document_id))
+
+                cur.execute("""
+                            UPDATE Document
+                            SET publisher_id = ?
+                            WHERE document_id = ?
+                            """, (publisher_id, document_id))
+
+                self._invalidate("publisher", [publisher_id])
+                self._invalidate("document", [document_id])
         except sqlite3.IntegrityError:
             print("This Document does not exist.")
 
-        self.con.commit()
-
     def get_user_by_username(self, username: str) -> User:
         """Get a user by its username"""
 
-        cur = self.con.cursor()
-
-        rows = cur.execute("""
-                        SELECT * FROM User
-                        WHERE username = ?
-                        """, (username,))
+        with self.pool.reader() as con:
+            rows = con.execute(f"""
+                               SELECT {mapping.USER.columns("User")}
+                               FROM User
+                               WHERE username = ?
+                               """, (username,))
+            row = rows.fetchone()
+
+        if row is None:
+            raise ValueError("This user does not exist.")
+
+        return mapping.USER.read(row)
+
+    def _load_documents(self, con: Connection, where: str,
+                        params: tuple = (),
+                        limit: int | None = None) -> list[Document]:
+        """Load the documents matching a WHERE clause
+
+        The clause picks document ids on the normalized tables and their
+        indexes; the documents themselves are read already assembled from
+        DocumentView, one row each. Authors and tags arrive as JSON that
+        is only decoded, for the whole result set, once any is used.
+        """
+
+        if self.cache is not None:
+            generation = self.cache.generation
+
+        rows = _tuples(con).execute(f"""
+                           SELECT {mapping.VIEW_COLUMNS}
+                           FROM DocumentView
+                           WHERE document_id IN (
+                               SELECT Document.document_id
+                               FROM Document
+                               LEFT JOIN Publisher
+                                   ON Document.publisher_id = Publisher.publisher_id
+                               LEFT JOIN Book
+                                   ON Document.document_id = Book.document_id
+                               LEFT JOIN Paper
+                                   ON Document.document_id = Paper.document_id
+                               {where}
+                               ORDER BY Document.document_id
+                               {"" if limit is None else "LIMIT ?"})
+                           ORDER BY document_id
+                           """, params if limit is None else (*params, limit))
+
+        encoded_authors: dict[int, str] = {}
+        encoded_tags: dict[int, str] = {}
+        authors = BatchLoader(partial(_decode, encoded_authors,
+                                      mapping.AUTHOR.read))
+        tags = BatchLoader(partial(_decode, encoded_tags, str))
 
-        return User.from_db_row(dict(rows.fetchone()))
+        documents: list[Document] = []
+        for row in rows:
+            if row[mapping.TYPE_INDEX] == "book":
+                document = mapping.JOINED_BOOK.read(row)
+            else:
+                document = mapping.JOINED_PAPER.read(row)
 
-    def _get_document_authors(self, document_id: int) -> list[Author]:
-        """Get all authors of a document"""
+            if row[mapping.PUBLISHER_OFFSET] is not None:
+                document.publisher = mapping.PUBLISHER.read(
+                    row, mapping.PUBLISHER_OFFSET)
 
-        cur = self.con.cursor()
+            encoded_authors[document.document_id] = row[mapping.AUTHORS_INDEX]
+            encoded_tags[document.document_id] = row[mapping.TAGS_INDEX]
+            document.authors = authors.add(document.document_id)
+            document.tags = tags.add(document.document_id)
+            documents.append(document)
 
-        rows = cur.execute("""
-                            SELECT Author.* FROM Author
-                            INNER JOIN Writes
-                                ON Writes.author_id = Author.author_id
-                                AND Writes.document_id = ?                                   
-                            """, (document_id, ))
+        if self.cache is not None:
+            for document in documents:
+                self.cache.put("document", document.document_id, document,
+                               generation)
 
-        authors: list[Author] = []
-        for row in rows:
-            authors.append(Author.from_db_row(dict(row)))
-
-        return authors
+        return documents
 
     def get_document_by_id(self, document_id: int) -> Document:
         """Get a document by its id"""
 
-        cur = self.con.cursor()
-        rows = cur.execute("""
-                        SELECT 
-                            Document.created_at AS doc_created_at,
-                            Publisher.created_at AS pub_created_at,
-                            * 
-                            FROM Document
-                        LEFT JOIN Publisher
-                            ON Document.publisher_id = Publisher.publisher_id
-                        LEFT JOIN Book
-                            ON Document.document_id = Book.document_id
-                        LEFT JOIN Paper
-                            ON Document.document_id = Paper.document_id
-                        WHERE Document.document_id = ?
-                        """, (document_id,))
-
-        row = rows.fetchone()
-        if not row:
-            raise ValueError("This document does not exist.")
+        if self.cache is not None:
+            document = self.cache.get("document", document_id)
+            if document is not None:
+                return document
 
-        data = dict(row)
-        if data["type"] == "book":
-            document = Book.from_db_row(data)
-        else:
-            document = Paper.from_db_row(data)
+        with self.pool.reader() as con:
+            documents = self._load_documents(
+                con, "WHERE Document.document_id = ?", (document_id,))
+
+        if not documents:
+            raise ValueError("This document does not exist.")
 
-        document.authors = self._get_document_authors(document_id)
-        return document
+        return documents[0]
 
+    @cached_query
     def get_documents_by_author(self, last_name: str) -> list[Document]:
         """Get all documents written by an author"""
 
-        rows = self.con.execute("""
-                                SELECT Writes.document_id from Author
-                                INNER JOIN Writes
-                                    ON Writes.author_id = Author.author_id 
-                                    AND Author.last_name = ?
-                                """, (last_name, ))
-
-        documents: list[Document] = []
-        for row in rows:
-            documents.append(self.get_document_by_id(row["document_id"]))
-
-        return documents
-
+        with self.pool.reader() as con:
+            return self._load_documents(con, """
+                                        WHERE Document.document_id IN (
+                                            SELECT Writes.document_id
+                                            FROM Author
+                                            INNER JOIN Writes
+                                                ON Writes.author_id = Author.author_id
+                                            WHERE Author.last_name = ?)
+                                        """, (last_name,))
+
+    @cached_query
     def get_documents_by_publisher(self, name: str) -> list[Document]:
         """Get all documents published by a publisher"""
 
-        rows = self.con.execute("""
-                                SELECT 
-                                    Document.created_at AS doc_created_at,
-                                    Publisher.created_at AS pub_created_at,
-                                    *
-                                    FROM Document
-                                INNER JOIN Publisher
-                                    ON Publisher.publisher_id = Document.publisher_id
-                                    AND Publisher.name = ?
-                                """, (name, ))
-
-        documents: list[Document] = []
-        for row in rows:
-            data = dict(row)
-            if data["type"] == "book":
-                document = Book.from_db_row(data)
-            else:
-                document = Paper.from_db_row(data)
-
-            document.authors = self._get_document_authors(data["document_id"])
+        with self.pool.reader() as con:
+            return self._load_documents(con, "WHERE Publisher.name = ?",
+                                        (name,))
+
+    def page(self, after_id: int = 0, limit: int = 100,
+             filters: dict | None = None) -> list[Document]:
+        """Get up to `limit` documents following `after_id`, in id order
+
+        Pass the id of the last document of a page to get the next one.
+        Pages seek on the primary key instead of skipping rows with OFFSET,
+        so page N costs the same as the first. Filters are keys of
+        DOCUMENT_FILTERS, e.g. {"type": "book", "tags_any": ["python"]}.
+        """
+
+        where, params = self._filter(after_id, filters)
+        with self.pool.reader() as con:
+            return self._load_documents(con, where, params, limit)
+
+    def _filter(self, after_id: int,
+                filters: dict | None) -> tuple[str, tuple]:
+        """Build the WHERE clause of a keyset page of documents"""
+
+        clauses = ["Document.document_id > ?"]
+        params = [after_id]
+        for key, value in (filters or {}).items():
+            if key not in DOCUMENT_FILTERS:
+                raise ValueError(f"Unknown document filter: {key}")
+            if key.startswith("tags_"):
+                value = json.dumps(clean_tags(value))
+            clauses.append(DOCUMENT_FILTERS[key])
+            params += [value] * DOCUMENT_FILTERS[key].count("?")
+
+        return "WHERE " + " AND ".join(clauses), tuple(params)
+
+    def iter_documents(self, filters: dict | None = None,
+                       batch_size: int = 1000) -> Iterator[Document]:
+        """Iterate over all documents, keeping one page in memory"""
+
+        after_id = 0
+        while True:
+            documents = self.page(after_id, batch_size, filters)
+            yield from documents
+
+            if len(documents) < batch_size:
+                return None
+            after_id = documents[-1].document_id
+
+    def _iter_rows(self, table: str, row_mapping: mapping.RowMapping,
+                   batch_size: int) -> Iterator:
+        """Walk a table in key order, one batch of rows per query
+
+        The key is the first mapped column. The reader is released between
+        batches, so a slow consumer never pins a pooled connection or keeps
+        a read transaction open.
+        """
+
+        key = row_mapping.fields[0]
+        after_id = 0
+        while True:
+            with self.pool.reader() as con:
+                res = _tuples(con).execute(f"""
+                                           SELECT {row_mapping.columns(table)}
+                                           FROM {table}
+                                           WHERE {key} > ?
+                                           ORDER BY {key}
+                                           LIMIT ?
+                                           """, (after_id, batch_size))
+                rows = res.fetchmany(batch_size)
+
+            for row in rows:
+                yield row_mapping.read(row)
+
+            if len(rows) < batch_size:
+                return None
+            after_id = rows[-1][0]
+
+    def iter_authors(self, batch_size: int = 1000) -> Iterator[Author]:
+        """Iterate over all authors, keeping one batch in memory"""
+
+        return self._iter_rows("Author", mapping.AUTHOR, batch_size)
+
+    def iter_publishers(self, batch_size: int = 1000) -> Iterator[Publisher]:
+        """Iterate over all publishers, keeping one batch in memory"""
+
+        return self._iter_rows("Publisher", mapping.PUBLISHER, batch_size)
+
+    def list_document_titles(self, type: str | None = None,
+                             filters: dict | None = None, after_id: int = 0,
+                             limit: int | None = None) -> list[DocumentTitle]:
+        """Get the ids and titles of documents, in id order
+
+        Reads two columns and nothing else; for a type alone the scan is
+        answered by the Document_type index. Takes the filters of page().
+        """
+
+        if type is not None:
+            filters = {**(filters or {}), "type": type}
+        where, params = self._filter(after_id, filters)
+
+        # Joined only when filtered on, so the Document_type index covers.
+        join = ""
+        if "publisher" in (filters or {}):
+            join = """LEFT JOIN Publisher
+                          ON Document.publisher_id = Publisher.publisher_id"""
+
+        with self.pool.reader() as con:
+            cur = con.cursor()
+            cur.row_factory = _row_maker(DocumentTitle)
+            return cur.execute(f"""
+                               SELECT Document.document_id, Document.title
+                               FROM Document
+                               {join}
+                               {where}
+                               ORDER BY Document.document_id
+                               LIMIT ?
+                               """, (*params, -1 if limit is None else limit)
+                               ).fetchall()
+
+    def list_author_names(self) -> list[AuthorName]:
+        """Get the ids and names of all authors, sorted by name"""
+
+        with self.pool.reader() as con:
+            cur = con.cursor()
+            cur.row_factory = _row_maker(AuthorName)
+            return cur.execute("""
+                               SELECT author_id, last_name, remaining_name
+                               FROM Author
+                               ORDER BY last_name, remaining_name
+                               """).fetchall()
+
+    def list_publisher_names(self) -> list[PublisherName]:
+        """Get the ids and names of all publishers, sorted by name"""
+
+        with self.pool.reader() as con:
+            cur = con.cursor()
+            cur.row_factory = _row_maker(PublisherName)
+            return cur.execute("""
+                               SELECT publisher_id, name
+                               FROM Publisher
+                               ORDER BY name
+                               """).fetchall()
+
+    @cached_query
+    def get_documents_by_tags(self, tags: list[str],
+                              match_all: bool = False) -> list[Document]:
+        """Get the documents with any, or all, of the given tags"""
+
+        key = "tags_all" if match_all else "tags_any"
+        return list(self.iter_documents({key: tags}))
+
+    @cached_query
+    def get_tag_counts(self, limit: int | None = None) -> dict[str, int]:
+        """Get how many documents each tag has, most used first"""
+
+        with self.pool.reader() as con:
+            rows = con.execute("""
+                               SELECT name, document_count FROM Tag
+                               WHERE document_count > 0
+                               ORDER BY document_count DESC, name
+                               LIMIT ?
+                               """, (-1 if limit is None else limit,))
+
+            return {row["name"]: row["document_count"] for row in rows}
+
+    @cached_query
+    def get_document_counts(self, by: str,
+                            limit: int | None = None) -> dict[Any, int]:
+        """Get how many documents each value of a dimension has, most first
+
+        `by` is one of STAT_DIMENSIONS. Documents without a value, e.g.
+        with no publisher, are not counted.
+        """
+
+        if by not in STAT_DIMENSIONS:
+            raise ValueError(f"Unknown document statistic: {by}")
+
+        with self.pool.reader() as con:
+            rows = _tuples(con).execute("""
+                                        SELECT value, document_count
+                                        FROM DocumentStat
+                                        WHERE dimension = ?
+                                            AND document_count > 0
+                                        ORDER BY document_count DESC, value
+                                        LIMIT ?
+                                        """,
+                                        (by, -1 if limit is None else limit))
+
+            return dict(rows)
+
+    def stats(self, limit: int | None = None) -> dict[str, dict[Any, int]]:
+        """Get the document counts of every dimension, most first"""
+
+        return {by: self.get_document_counts(by, limit)
+                for by in STAT_DIMENSIONS}
+
+    @cached_query
+    def search(self, query: str, limit: int = 20, type: str | None = None,
+               year: int | None = None) -> list[SearchResult]:
+        """Search titles, abstracts and journals, best matches first
+
+        The query uses the FTS5 syntax (prefix*, "phrases", OR, NOT). One
+        that does not parse is searched for as plain words instead.
+        """
 
-            documents.append(document)
-        return documents
+        try:
+            return self._search(query, limit, type, year)
+        except sqlite3.OperationalError:
+            words = " ".join('"' + word.replace('"', '""') + '"'
+                             for word in query.split())
+            return self._search(words, limit, type, year) if words else []
+
+    def _search(self, query: str, limit: int, type: str | None,
+                year: int | None) -> list[SearchResult]:
+        with self.pool.reader() as con:
+            # Title matches weigh the most, then journal, then abstract.
+            rows = con.execute("""
+                               SELECT
+                                   DocumentSearch.rowid AS document_id,
+                                   bm25(DocumentSearch, 10.0, 1.0, 4.0)
+                                       AS rank,
+                                   snippet(DocumentSearch, -1, '[', ']',
+                                           '...', 16) AS snippet
+                               FROM DocumentSearch
+                               INNER JOIN Document
+                                   ON Document.document_id = DocumentSearch.rowid
+                               WHERE DocumentSearch MATCH :query
+                               AND (:type IS NULL OR Document.type = :type)
+                               AND (:year IS NULL OR Document.year = :year)
+                               ORDER BY rank
+                               LIMIT :limit
+                               """,
+                               {"query": query, "type": type, "year": year,
+                                "limit": limit}).fetchall()
+
+            documents = self._load_documents(
+                con, """
+                     WHERE Document.document_id IN
+                         (SELECT value FROM json_each(?))
+                     """, (json.dumps([row["document_id"] for row in rows]),))
+
+        by_id = {document.document_id: document for document in documents}
+        return [SearchResult(document=by_id[row["document_id"]],
+                             rank=row["rank"], snippet=row["snippet"])
+                for row in rows]
 
     def get_book_by_id(self, document_id: int) -> Book:
         """Get a book by its id"""
@@ -337,73 +773,57 @@ class DBHandler:
     def get_users(self) -> list[User]:
         """Get all users"""
 
-        rows = self.con.execute("""
-                                SELECT * FROM User
-                                """)
-
-        users: list[User] = []
-        for row in rows:
-            users.append(User.from_db_row(dict(row)))
+        with self.pool.reader() as con:
+            rows = _tuples(con).execute(f"""
+                                        SELECT {mapping.USER.columns("User")}
+                                        FROM User
+                                        """)
 
-        return users
+            return [mapping.USER.read(row) for row in rows]
 
+    @cached_query
     def get_books(self) -> list[Book]:
         """Get all books"""
 
-        rows = self.con.execute("""
-                                SELECT Document.document_id FROM Document
-                                INNER JOIN Book
-                                    ON Document.document_id = Book.document_id
-                                    AND Document.type = "book"
-                                """)
-
-        books: list[Book] = []
-        for row in rows:
-            books.append(self.get_document_by_id(row["document_id"]))
-
-        return books
+        with self.pool.reader() as con:
+            return self._load_documents(con, """
+                                        WHERE Document.type = "book"
+                                        AND Book.document_id IS NOT NULL
+                                        """)
 
+    @cached_query
     def get_papers(self) -> list[Paper]:
         """Get all papers"""
 
-        rows = self.con.execute("""
-                                SELECT Document.document_id FROM Document
-                                INNER JOIN Paper
-                                ON Document.document_id = Paper.document_id
-                                AND Document.type = "paper"
-                                """)
-
-        papers: list[Paper] = []
-        for row in rows:
-            papers.append(self.get_document_by_id(row["document_id"]))
-
-        return papers
+        with self.pool.reader() as con:
+            return self._load_documents(con, """
+                                        WHERE Document.type = "paper"
+                                        AND Paper.document_id IS NOT NULL
+                                        """)
 
+    @cached_query
     def get_authors(self) -> list[Author]:
         """Get all authors"""
 
-        rows = self.con.execute("""
-                                SELECT * FROM Author
-                                """)
-
-        authors: list[Author] = []
-        for row in rows:
-            authors.append(Author.from_db_row(dict(row)))
+        with self.pool.reader() as con:
+            rows = _tuples(con).execute(f"""
+                                        SELECT {mapping.AUTHOR.columns("Author")}
+                                        FROM Author
+                                        """)
 
-        return authors
+            return [mapping.AUTHOR.read(row) for row in rows]
 
+    @cached_query
     def get_publishers(self) -> list[Publisher]:
         """Get all publishers"""
 
-        rows = self.con.execute("""
-                                SELECT * FROM Publisher
-                                """)
+        with self.pool.reader() as con:
+            rows = _tuples(con).execute(f"""
+                                        SELECT {mapping.PUBLISHER.columns("Publisher")}
+                                        FROM Publisher
+                                        """)
 
-        publishers: list[Publisher] = []
-        for row in rows:
-            publishers.append(Publisher.from_db_row(dict(row)))
-
-        return publishers
+            return [mapping.PUBLISHER.read(row) for row in rows]
 
     def get_paper_by_id(self, document_id: int) -> Paper:
         """Get a paper by its id"""
@@ -417,158 +837,174 @@ class DBHandler:
     def get_author_by_id(self, author_id: int) -> Author:
         """Get an author by its id"""
 
-        cur = self.con.cursor()
+        if self.cache is not None:
+            author = self.cache.get("author", author_id)
+            if author is not None:
+                return author
+            generation = self.cache.generation
 
-        rows = cur.execute("""
-                        SELECT * FROM Author
-                        WHERE author_id = ?
-                        """, (author_id,))
+        with self.pool.reader() as con:
+            rows = con.execute(f"""
+                               SELECT {mapping.AUTHOR.columns("Author")}
+                               FROM Author
+                               WHERE author_id = ?
+                               """, (author_id,))
 
-        author = Author.from_db_row(dict(rows.fetchone()))
+            author = mapping.AUTHOR.read(rows.fetchone())
 
-        docs = cur.execute("""
-                           SELECT Document.document_id FROM Document
-                           INNER JOIN Writes
-                                ON Writes.document_id = Document.document_id 
-                                AND Writes.author_id = ?
-                            """, (author_id,))
+            docs = con.execute("""
+                               SELECT Document.document_id FROM Document
+                               INNER JOIN Writes
+                                   ON Writes.document_id = Document.document_id
+                                   AND Writes.author_id = ?
+                               """, (author_id,))
 
-        for doc in docs:
-            author.document_ids.append(doc["document_id"])
+            for doc in docs:
+                author.document_ids.append(doc["document_id"])
+
+        if self.cache is not None:
+            self.cache.put("author", author.author_id, author, generation)
 
         return author
 
     def get_publisher_by_id(self, publisher_id: int) -> Publisher:
         """Get a publisher by its id"""
 
-        cur = self.con.cursor()
+        if self.cache is not None:
+            publisher = self.cache.get("publisher", publisher_id)
+            if publisher is not None:
+                return publisher
+            generation = self.cache.generation
+
+        with self.pool.reader() as con:
+            rows = con.execute(f"""
+                               SELECT {mapping.PUBLISHER.columns("Publisher")}
+                               FROM Publisher
+                               WHERE publisher_id = ?
+                               """, (publisher_id,))
 
-        rows = cur.execute("""
-                        SELECT * FROM Publisher
-                        WHERE publisher_id = ?
-                        """, (publisher_id,))
+            publisher = mapping.PUBLISHER.read(rows.fetchone())
 
-        publisher = Publisher.from_db_row(dict(rows.fetchone()))
+            docs = con.execute("""
+                               SELECT Document.document_id FROM Document
+                               WHERE Document.publisher_id = ?
+                               """, (publisher_id,))
 
-        docs = cur.execute("""
-                           SELECT Document.document_id FROM Document
-                           WHERE Document.publisher_id = ?
-                           """, (publisher_id,))
+            for doc in docs:
+                publisher.document_ids.append(doc["document_id"])
 
-        for doc in docs:
-            publisher.document_ids.append(doc["document_id"])
+        if self.cache is not None:
+            self.cache.put("publisher", publisher.publisher_id, publisher,
+                           generation)
 
         return publisher
 
     def update_user(self, user: User) -> None:
         """Update a user"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        UPDATE User
-                        SET username = ?, password = ?, email = ?
-                        WHERE user_id = ?
-                        """, (user.username, user.password,
-                              user.email, user.user_id))
+            with self._transaction() as cur:
+                cur.execute("""
+                            UPDATE User
+                            SET username = ?, password = ?, email = ?
+                            WHERE user_id = ?
+                            """, (user.username, user.password,
+                                  user.email, user.user_id))
         except sqlite3.IntegrityError:
             print("This User does not exist.")
 
-        self.con.commit()
-
     def update_publisher(self, publisher: Publisher) -> None:
         """Update a publisher"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        UPDATE Publisher
-                        SET name = ?, address = ?, url = ?
-                        WHERE publisher_id = ?
-                        """, (publisher.name, publisher.address,
-                              publisher.url, publisher.publisher_id))
+            with self._transaction() as cur:
+                # Queued first: the caller may have changed a cached
+                # instance, which must go even if the update fails.
+                self._invalidate("publisher", [publisher.publisher_id])
+                self._invalidate("document", self._linked_ids(cur, """
+                    SELECT document_id FROM Document
+                    WHERE publisher_id = ?
+                    """, publisher.publisher_id))
+
+                cur.execute("""
+                            UPDATE Publisher
+                            SET name = ?, address = ?, url = ?
+                            WHERE publisher_id = ?
+                            """, (publisher.name, publisher.address,
+                                  publisher.url, publisher.publisher_id))
         except sqlite3.IntegrityError:
             print("This Publisher does not exist.")
 
-        self.con.commit()
-
     def update_author(self, author: Author) -> None:
         """Update an author"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        UPDATE Author
-                        SET last_name = ?, remaining_name = ?, birth_date = ?,
-                        email = ?, social_url = ?, nationality = ?
-                        WHERE author_id = ?
-                        """, (author.last_name, author.remaining_name,
-                              author.birth_date, author.email, author.social_url,
-                              author.nationality, author.author_id))
-        except sqlite3.integrityError:
-            print("This Author does not exist.")
+            with self._transaction() as cur:
+                self._invalidate("author", [author.author_id])
+                self._invalidate("document", self._linked_ids(cur, """
+                    SELECT document_id FROM Writes
+                    WHERE author_id = ?
+                    """, author.author_id))
 
-        self.con.commit()
+                cur.execute("""
+                            UPDATE Author
+                            SET last_name = ?, remaining_name = ?,
+                            birth_date = ?, email = ?, social_url = ?,
+                            nationality = ?
+                            WHERE author_id = ?
+                            """, (author.last_name, author.remaining_name,
+                                  author.birth_date, author.email,
+                                  author.social_url, author.nationality,
+                                  author.author_id))
+        except sqlite3.IntegrityError:
+            print("This Author does not exist.")
 
     def update_document(self, document: Document) -> None:
         """Update a document"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        UPDATE Document
-                        SET title = ?, language = ?, year = ?
-                        WHERE document_id = ?
-                        """, (document.title, document.language,
-                              document.year, document.document_id))
-        except sqlite3.IntegrityError:
-            print("This Document does not exist.")
-            return None
+            with self._transaction() as cur:
+                self._invalidate("document", [document.document_id])
 
-        if isinstance(document, Book):
-            try:
                 cur.execute("""
-                            UPDATE Book
-                            SET isbn = ?, edition = ?, publication_place = ?
+                            UPDATE Document
+                            SET title = ?, language = ?, year = ?,
+                            abstract = ?
                             WHERE document_id = ?
-                            """, (document.isbn, document.edition,
-                                  document.publication_place,
+                            """, (document.title, document.language,
+                                  document.year, document.abstract,
                                   document.document_id))
-            except sqlite3.IntegrityError:
-                print("This Book does not exist.")
-                return None
-        else:
-            try:
-                cur.execute("""
-                            UPDATE Paper
-                            SET doi = ?, journal = ?, issue = ?, pages = ?,
-                            volume = ?
-                            WHERE document_id = ?
-                            """, (document.doi, document.journal,
-                                  document.issue, document.pages,
-                                  document.volume, document.document_id))
-            except sqlite3.IntegrityError:
-                print("This Paper does not exist.")
-                return None
 
-        self.con.commit()
+                if isinstance(document, Book):
+                    cur.execute("""
+                                UPDATE Book
+                                SET isbn = ?, edition = ?,
+                                publication_place = ?
+                                WHERE document_id = ?
+                                """, (document.isbn, document.edition,
+                                      document.publication_place,
+                                      document.document_id))
+                else:
+                    cur.execute("""
+                                UPDATE Paper
+                                SET doi = ?, journal = ?, issue = ?,
+                                pages = ?, volume = ?
+                                WHERE document_id = ?
+                                """, (document.doi, document.journal,
+                                      document.issue, document.pages,
+                                      document.volume, document.document_id))
+        except sqlite3.IntegrityError:
+            print("This Document does not exist.")
 
     def delete_user(self, user_id: int) -> None:
         """Delete a user"""
 
-        cur = self.con.cursor()
-
         try:
-            cur.execute("""
-                        DELETE FROM User
-                        WHERE user_id = ?
-                        """, (user_id,))
-
-            self.con.commit()
+            with self._transaction() as cur:
+                cur.execute("""
+                            DELETE FROM User
+                            WHERE user_id = ?
+                            """, (user_id,))
         except sqlite3.Error:
             print("Something went wrong.")
             print(traceback.format_exc())
@@ -576,82 +1012,85 @@ class DBHandler:
     def delete_publisher(self, publisher_id: int) -> None:
         """Delete a publisher"""
 
-        self.con.isolation_level = None
         try:
-            cur = self.con.cursor()
-            cur.execute("BEGIN")
-
-            cur.execute("""
-                        DELETE FROM Publisher
-                        WHERE publisher_id = ?
-                        """, (publisher_id,))
+            with self._transaction() as cur:
+                self._invalidate("publisher", [publisher_id])
+                self._invalidate("document", self._linked_ids(cur, """
+                    SELECT document_id FROM Document
+                    WHERE publisher_id = ?
+                    """, publisher_id))
 
-            self.con.commit()
+                cur.execute("""
+                            DELETE FROM Publisher
+                            WHERE publisher_id = ?
+                            """, (publisher_id,))
         except sqlite3.Error:
             print("Something went wrong. Transaction cancelled")
             print(traceback.format_exc())
-            self.con.rollback()
 
     def delete_author(self, author_id: int) -> None:
         """Delete an author"""
 
-        self.con.isolation_level = None
         try:
-            cur = self.con.cursor()
-            cur.execute("BEGIN")
-
-            cur.execute("""
-                        DELETE FROM Writes
-                        WHERE author_id = ?
-                        """, (author_id, ))
+            with self._transaction() as cur:
+                self._invalidate("author", [author_id])
+                self._invalidate("document", self._linked_ids(cur, """
+                    SELECT document_id FROM Writes
+                    WHERE author_id = ?
+                    """, author_id))
 
-            cur.execute("""
-                        DELETE FROM Author
-                        WHERE author_id = ?
-                        """, (author_id,))
+                cur.execute("""
+                            DELETE FROM Writes
+                            WHERE author_id = ?
+                            """, (author_id, ))
 
-            self.con.commit()
+                cur.execute("""
+                            DELETE FROM Author
+                            WHERE author_id = ?
+                            """, (author_id,))
         except sqlite3.Error:
             print("Something went wrong. Transaction cancelled")
             print(traceback.format_exc())
-            self.con.rollback()
 
     def delete_document(self, document_id: int) -> None:
         """Delete a document"""
 
-        self.con.isolation_level = None
         try:
-            cur = self.con.cursor()
-            cur.execute("BEGIN")
-            is_books = True
-            rows = cur.execute("""
-                               SELECT document_id from Book
-                               WHERE document_id = ?
-                               """, (document_id, ))
-
-            is_book = False if not rows.fetchone() else True
-
-            if is_book:
-                table = "Book"
-            else:
-                table = "Paper"
-
-            subtype_del_query = f"DELETE FROM {table} WHERE document_id = ?"
-            cur.execute(subtype_del_query, (document_id, ))
+            with self._transaction() as cur:
+                self._invalidate("document", [document_id])
+                self._invalidate("author", self._linked_ids(cur, """
+                    SELECT author_id FROM Writes
+                    WHERE document_id = ?
+                    """, document_id))
+                self._invalidate("publisher", self._linked_ids(cur, """
+                    SELECT publisher_id FROM Document
+                    WHERE document_id = ?
+                    """, document_id))
+
+                rows = cur.execute("""
+                                   SELECT document_id from Book
+                                   WHERE document_id = ?
+                                   """, (document_id, ))
+
+                is_book = False if not rows.fetchone() else True
+
+                if is_book:
+                    table = "Book"
+                else:
+                    table = "Paper"
+
+                subtype_del_query = f"DELETE FROM {table} WHERE document_id = ?"
+                cur.execute(subtype_del_query, (document_id, ))
 
-            cur.execute("""
-                        DELETE FROM Writes
-                        WHERE document_id = ?
-                        """, (document_id, ))
-
-            cur.execute("""
-                        DELETE FROM Document
-                        WHERE document_id = ?
-                        """, (document_id, ))
-
-            self.con.commit()
+                cur.execute("""
+                            DELETE FROM Writes
+                            WHERE document_id = ?
+                            """, (document_id, ))
 
+                cur.execute("""
+                            DELETE FROM Document
+                            WHERE document_id = ?
+                            """, (document_id, ))
         except sqlite3.Error:
             print(traceback.format_exc())
             print("Something went Wrong. Transaction Cancelled.")
-            self.con.rollback()
@@ -0,0 +1,703 @@
+import hashlib
+import json
+import queue
+import threading
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from itertools import islice
+from pathlib import Path
+from typing import Iterable, Iterator
+from .base import Connection
+from . import mapping
+from .migrations import count_documents, refresh_document_view
+from ..csl import iter_records
+from ..domain import Paper, Author, Publisher, Book, Document
+
+BOOK_TYPES = {"book"}
+
+# The unique identifier column of each document subtype.
+IDENTIFIERS = {Book: ("Book", "isbn"), Paper: ("Paper", "doi")}
+
+# Put on the batch queue once the reader thread runs out of records.
+_END = object()
+
+
+@dataclass(kw_only=True)
+class IngestReport:
+    records: int = 0
+    inserted: int = 0
+    updated: int = 0
+    skipped: int = 0
+    invalid: int = 0
+    duplicate_ids: int = 0
+    elapsed: float = 0.0
+    resumed_at: int = 0
+    already_imported: bool = False
+
+    @property
+    def records_per_sec(self) -> float:
+        if not self.elapsed:
+            return 0.0
+        return self.records / self.elapsed
+
+    def __str__(self) -> str:
+        if self.already_imported:
+            return "already imported, skipped"
+
+        counts = (f"{self.inserted} inserted, {self.updated} updated, "
+                  f"{self.skipped} skipped")
+        if self.invalid:
+            counts += f", {self.invalid} invalid"
+        summary = (f"{self.records} records ({counts}) in {self.elapsed:.2f}s "
+                   f"- {self.records_per_sec:.0f} records/sec")
+        if self.duplicate_ids:
+            summary += (f", {self.duplicate_ids} duplicate ISBNs/DOIs "
+                        f"left out")
+        if self.resumed_at:
+            summary = f"resumed after {self.resumed_at} records, {summary}"
+        return summary
+
+
+def file_hash(path: str | Path) -> str:
+    """Return the SHA-256 digest of a file, read in chunks"""
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def parse_record(data: dict) -> Document | None:
+    """Create a Book or a Paper from a CSL-JSON record
+
+    Returns None for a record that cannot be stored, e.g. without a title.
+    """
+
+    if not isinstance(data, dict):
+        return None
+    title = data.get("title")
+    if not isinstance(title, str) or not title.strip():
+        return None
+
+    if data.get("type") in BOOK_TYPES:
+        document = Book.from_raw_data(data)
+    else:
+        document = Paper.from_raw_data(data)
+
+    document.content_hash = content_hash(document)
+    return document
+
+
+def content_hash(document: Document) -> str:
+    """Hash the normalized fields of a document that an import writes"""
+
+    if isinstance(document, Book):
+        fields = [document.isbn, document.edition,
+                  document.publication_place]
+    else:
+        fields = [document.doi, document.journal, document.issue,
+                  document.pages, document.volume]
+
+    publisher = document.publisher
+    fields += [
+        _type(document), document.title, document.language, document.year,
+        document.abstract,
+        [publisher.name, publisher.address, publisher.url]
+        if publisher else None,
+        [_author_key(author) for author in document.authors],
+        document.tags,
+    ]
+
+    return hashlib.sha256(repr(fields).encode()).hexdigest()
+
+
+def parse_records(raw_records: list[dict]) -> list[Document | None]:
+    """Parse a batch of CSL-JSON records, None for each invalid one"""
+
+    return [parse_record(raw_record) for raw_record in raw_records]
+
+
+class BulkIngestor:
+    """Write whole CSL-JSON corpora in large batched transactions"""
+
+    def __init__(self, con: Connection, user_id: int,
+                 batch_size: int = 5000):
+        self.con = con
+        self.user_id = user_id
+        self.batch_size = batch_size
+        self.resolver = IdResolver()
+
+    def ingest_file(self, path: str | Path) -> IngestReport:
+        """Ingest every record of a CSL-JSON or JSON Lines file
+
+        Runs are recorded in the ImportLog table by content hash. A file
+        that was fully imported before is skipped, and an interrupted run
+        resumes after the last committed batch.
+        """
+
+        source_hash = file_hash(path)
+        import_id, offset, status = self._start_import(path, source_hash)
+
+        if status == "complete":
+            return IngestReport(already_imported=True)
+
+        raw_records = islice(iter_records(path), offset, None)
+        report = self.ingest(raw_records, import_id)
+        report.resumed_at = offset
+
+        cur = self.con.cursor()
+        cur.execute("""
+                    UPDATE ImportLog
+                    SET status = 'complete', finished_at = ?
+                    WHERE import_id = ?
+                    """, (datetime.now(), import_id))
+        self.con.commit()
+
+        return report
+
+    def _start_import(self, path: str | Path, source_hash: str
+                      ) -> tuple[int, int, str]:
+        """Find or create the ImportLog entry of a source file"""
+
+        cur = self.con.cursor()
+        res = cur.execute("""
+                          INSERT INTO ImportLog
+                          (source_path, source_hash, status, started_at)
+                          VALUES(?, ?, 'running', ?)
+                          ON CONFLICT(source_hash)
+                              DO UPDATE SET source_path = excluded.source_path
+                          RETURNING import_id, record_offset, status
+                          """, (str(path), source_hash, datetime.now()))
+
+        import_id, offset, status = res.fetchone()
+        self.con.commit()
+
+        return import_id, offset, status
+
+    def ingest(self, raw_records: Iterable[dict],
+               import_id: int | None = None) -> IngestReport:
+        """Parse and ingest CSL-JSON records, one transaction per batch
+
+        Records are read and parsed on a thread of their own, which hands
+        the batches to this one through a bounded queue, so parsing the
+        next batch overlaps writing the current one (SQLite releases the
+        GIL while it writes) and only a few batches are held in memory.
+        When an ImportLog entry is given, its checkpoint advances in the
+        same transaction as each batch.
+        """
+
+        report = IngestReport()
+        start = time.perf_counter()
+
+        batches: queue.Queue = queue.Queue(maxsize=2)
+        stop = threading.Event()
+        reader = threading.Thread(target=self._read_batches,
+                                  args=(raw_records, batches, stop),
+                                  daemon=True)
+        reader.start()
+        try:
+            while (batch := batches.get()) is not _END:
+                if isinstance(batch, BaseException):
+                    raise batch
+                self._flush(batch, report, import_id)
+        finally:
+            stop.set()
+            reader.join()
+
+        # The tables may have grown by orders of magnitude; refresh the
+        # statistics the query planner relies on where they went stale.
+        self.con.execute("PRAGMA optimize")
+
+        report.elapsed = time.perf_counter() - start
+        return report
+
+    def _read_batches(self, raw_records: Iterable[dict],
+                      batches: queue.Queue, stop: threading.Event) -> None:
+        """Parse the records into batches and queue them for the writer
+
+        Runs on the reader thread until the records run out, an error
+        occurs, which is queued for the writer to raise, or the writer
+        stops.
+        """
+
+        def put(item) -> bool:
+            while not stop.is_set():
+                try:
+                    batches.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for chunk in _chunks(raw_records, self.batch_size):
+                if not put(parse_records(chunk)):
+                    return None
+        except Exception as error:
+            put(error)
+        else:
+            put(_END)
+
+    def _flush(self, batch: list[Document | None], report: IngestReport,
+               import_id: int | None) -> None:
+        inserted, updated, duplicate_ids = self.write_batch(batch,
+                                                            import_id)
+        invalid = batch.count(None)
+        report.records += len(batch)
+        report.inserted += inserted
+        report.updated += updated
+        report.invalid += invalid
+        report.duplicate_ids += duplicate_ids
+        report.skipped += len(batch) - inserted - updated - invalid
+
+    def write_batch(self, records: list[Document | None],
+                    import_id: int | None = None) -> tuple[int, int, int]:
+        """Write a batch of documents in a single transaction
+
+        None stands for an invalid record: nothing is written for it, but
+        the checkpoint moves past it, so a resumed import does not stop at
+        it again. Returns how many documents were inserted, how many stored
+        ones were updated because their content hash changed, and how many
+        ISBNs or DOIs were left out because another document has them.
+        """
+
+        documents = [document for document in records if document is not None]
+
+        cur = self.con.cursor()
+        cur.execute("BEGIN IMMEDIATE")
+        try:
+            if not self.resolver.loaded:
+                self.resolver.load(cur)
+
+            # The DocumentView rows and DocumentStat counts of the batch
+            # are written once at the end instead of by triggers on every
+            # row and link written.
+            cur.execute("INSERT INTO DocumentViewPaused VALUES(1)")
+            cur.execute("INSERT INTO DocumentStatPaused VALUES(1)")
+
+            publisher_ids = self._resolve_publishers(cur, documents)
+            new_documents, changed_documents = self._write_documents(
+                cur, documents, publisher_ids)
+            written = new_documents + changed_documents
+            duplicate_ids = self._write_subtypes(cur, written)
+            author_ids = self._write_authors(cur, written, changed_documents)
+            self._write_tags(cur, written)
+
+            refresh_document_view(cur, [document.document_id
+                                        for document in written])
+            count_documents(cur, [document.document_id
+                                  for document in new_documents],
+                            author_ids)
+            cur.execute("DELETE FROM DocumentViewPaused")
+            cur.execute("DELETE FROM DocumentStatPaused")
+
+            if import_id is not None:
+                cur.execute("""
+                            UPDATE ImportLog
+                            SET record_offset = record_offset + ?,
+                            inserted_count = inserted_count + ?
+                            WHERE import_id = ?
+                            """, (len(records), len(new_documents),
+                                  import_id))
+
+            self.con.commit()
+        except BaseException:
+            self.con.rollback()
+            self.resolver.rollback()
+            raise
+
+        self.resolver.commit()
+
+        return len(new_documents), len(changed_documents), duplicate_ids
+
+    def _resolve_publishers(self, cur, documents: list[Document]
+                            ) -> dict[str, int]:
+        """Map the publisher names of a batch to ids"""
+
+        publishers = {}
+        for document in documents:
+            if document.publisher and document.publisher.name:
+                publishers.setdefault(document.publisher.name,
+                                      document.publisher)
+
+        return self.resolver.resolve_publishers(cur, publishers)
+
+    def _write_documents(self, cur, documents: list[Document],
+                         publisher_ids: dict[str, int]
+                         ) -> tuple[list[Document], list[Document]]:
+        """Insert new documents and update the changed ones of a batch
+
+        Stored documents are matched by title and year and compared by
+        content hash, so unchanged documents cost nothing beyond the one
+        lookup shared by the whole batch. Undated records match with IS,
+        since UNIQUE (title, year) would let NULL years repeat. Documents
+        without a content hash were not imported and are left alone.
+        """
+
+        keys = {(document.title, document.year): document
+                for document in documents}
+
+        # CROSS JOIN keeps the batch as the outer loop, whatever the table
+        # statistics say, so each key costs one index search.
+        rows = cur.execute("""
+                           SELECT Document.document_id, Document.title,
+                                  Document.year, Document.content_hash
+                           FROM json_each(?) AS batch
+                           CROSS JOIN Document
+                               ON Document.title IS
+                                   json_extract(batch.value, '$[0]')
+                               AND Document.year IS
+                                   json_extract(batch.value, '$[1]')
+                           """, (json.dumps(list(keys)),))
+
+        changed_documents: list[Document] = []
+        for row in rows:
+            document = keys.pop((row["title"], row["year"]), None)
+            if row["content_hash"] is None:
+                continue
+            if document and document.content_hash != row["content_hash"]:
+                document.document_id = row["document_id"]
+                changed_documents.append(document)
+
+        new_documents = list(keys.values())
+        if new_documents:
+            res = cur.execute("""
+                              SELECT coalesce(max(document_id), 0)
+                              FROM Document
+                              """)
+            next_id = res.fetchone()[0] + 1
+
+            for document in new_documents:
+                document.document_id = next_id
+                next_id += 1
+
+        cur.executemany("""
+                        INSERT INTO Document
+                        (document_id, title, language, year, publisher_id,
+                        created_at, type, user_id, content_hash, abstract)
+                        VALUES(?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                        """, [(document.document_id, document.title,
+                               document.language, document.year,
+                               _publisher_id(document, publisher_ids),
+                               document.created_at, _type(document),
+                               self.user_id, document.content_hash,
+                               document.abstract)
+                              for document in new_documents])
+
+        if changed_documents:
+            cur.executemany("""
+                            UPDATE Document
+                            SET language = ?, publisher_id = ?, type = ?,
+                            content_hash = ?, abstract = ?
+                            WHERE document_id = ?
+                            """, [(document.language,
+                                   _publisher_id(document, publisher_ids),
+                                   _type(document), document.content_hash,
+                                   document.abstract, document.document_id)
+                                  for document in changed_documents])
+
+            # A document can only have changed type; its other row goes.
+            for cls, (table, _) in IDENTIFIERS.items():
+                cur.execute(f"""
+                            DELETE FROM {table}
+                            WHERE document_id IN
+                                (SELECT value FROM json_each(?))
+                            """, (json.dumps([
+                                document.document_id
+                                for document in changed_documents
+                                if not isinstance(document, cls)]),))
+
+            changed_ids = json.dumps([document.document_id
+                                      for document in changed_documents])
+
+            # Tags given by users are not the import's to replace.
+            cur.execute("""
+                        DELETE FROM DocumentTag
+                        WHERE document_id IN (SELECT value FROM json_each(?))
+                            AND source = 'keyword'
+                        """, (changed_ids,))
+
+        return new_documents, changed_documents
+
+    def _write_subtypes(self, cur, documents: list[Document]) -> int:
+        """Write the Book and Paper rows of the written documents
+
+        Stored rows are only updated where a value changed. An ISBN or DOI
+        already used by another document, stored or earlier in the batch,
+        is left out rather than dropping the whole row, e.g. for volumes
+        of a set that share the ISBN of the set. Returns how many were
+        left out.
+        """
+
+        duplicate_ids = 0
+        for cls, (table, column) in IDENTIFIERS.items():
+            subtype = [document for document in documents
+                       if isinstance(document, cls)]
+            identifiers = [getattr(document, column) for document in subtype]
+
+            rows = cur.execute(f"""
+                               SELECT {column}, document_id FROM {table}
+                               WHERE {column} IN
+                                   (SELECT value FROM json_each(?))
+                               """, (json.dumps(identifiers),))
+            owners = {row[0]: row[1] for row in rows}
+
+            for document in subtype:
+                identifier = getattr(document, column)
+                if identifier is None:
+                    continue
+                owner = owners.setdefault(identifier, document.document_id)
+                if owner != document.document_id:
+                    setattr(document, column, None)
+                    duplicate_ids += 1
+
+            row_mapping = mapping.BOOK if cls is Book else mapping.PAPER
+            columns = row_mapping.fields[1:]
+            cur.executemany(f"""
+                            INSERT INTO {table}
+                            VALUES({row_mapping.placeholders})
+                            ON CONFLICT(document_id) DO UPDATE SET
+                                {", ".join(f"{name} = excluded.{name}"
+                                           for name in columns)}
+                            WHERE {" OR ".join(f"{name} IS NOT excluded.{name}"
+                                               for name in columns)}
+                            """, [row_mapping.params(document)
+                                  for document in subtype])
+
+        return duplicate_ids
+
+    def _write_authors(self, cur, documents: list[Document],
+                       changed_documents: list[Document]) -> list[int]:
+        """Link the documents of a batch to their authors
+
+        Only the differences are written: links the record no longer has
+        are removed if an import made them, and links made by users stay.
+        Returns the author ids of the links added.
+        """
+
+        author_ids = self._resolve_authors(cur, documents)
+        links = list(dict.fromkeys(
+            (document.document_id, author_ids[_author_key(author)])
+            for document in documents
+            for author in document.authors))
+
+        changed_ids = [document.document_id for document in changed_documents]
+        rows = cur.execute("""
+                           SELECT document_id, author_id, source FROM Writes
+                           WHERE document_id IN
+                               (SELECT value FROM json_each(?))
+                           """, (json.dumps(changed_ids),))
+        stored = {(row[0], row[1]): row[2] for row in rows}
+
+        wanted = set(links)
+        stale = [link for link, source in stored.items()
+                 if source == "import" and link not in wanted]
+        new_links = [link for link in links if link not in stored]
+
+        cur.execute("""
+                    DELETE FROM Writes
+                    WHERE (document_id, author_id) IN (
+                        SELECT json_extract(value, '$[0]'),
+                               json_extract(value, '$[1]')
+                        FROM json_each(?))
+                    """, (json.dumps(stale),))
+
+        cur.executemany("""
+                        INSERT INTO Writes (document_id, author_id, source)
+                        VALUES(?, ?, 'import')
+                        """, new_links)
+
+        return [author_id for document_id, author_id in new_links]
+
+    def _write_tags(self, cur, documents: list[Document]) -> None:
+        """Link the documents of a batch to their tags, creating new ones
+
+        A tag a user already gave the document keeps its user link.
+        """
+
+        links = json.dumps([(document.document_id, tag)
+                            for document in documents
+                            for tag in document.tags])
+
+        cur.execute("""
+                    INSERT INTO Tag (name)
+                    SELECT DISTINCT json_extract(value, '$[1]')
+                    FROM json_each(?)
+                    WHERE true
+                    ON CONFLICT(name) DO NOTHING
+                    """, (links,))
+
+        cur.execute("""
+                    INSERT OR IGNORE INTO DocumentTag
+                    (document_id, tag_id, source)
+                    SELECT json_extract(value, '$[0]'), Tag.tag_id, 'keyword'
+                    FROM json_each(?)
+                    CROSS JOIN Tag
+                        ON Tag.name = json_extract(value, '$[1]')
+                    """, (links,))
+
+    def _resolve_authors(self, cur, documents: list[Document]
+                         ) -> dict[tuple, int]:
+        """Map the author names of a batch to ids"""
+
+        authors = {}
+        for document in documents:
+            for author in document.authors:
+                authors.setdefault(_author_key(author), author)
+
+        return self.resolver.resolve_authors(cur, authors)
+
+
+class IdResolver:
+    """Ingest-scoped name to id maps for publishers and authors
+
+    The maps are preloaded from the Publisher and Author tables, so only
+    names never seen before cost a round-trip. Ids created inside a
+    transaction are kept apart until it commits, so a rolled back batch
+    cannot leave ids of rows that no longer exist in the maps.
+    """
+
+    def __init__(self):
+        self.publisher_ids: dict[str, int] = {}
+        self.author_ids: dict[tuple, int] = {}
+        self._new_publisher_ids: dict[str, int] = {}
+        self._new_author_ids: dict[tuple, int] = {}
+        self.loaded = False
+
+    def load(self, cur) -> None:
+        """Preload every stored publisher and author"""
+
+        rows = cur.execute("SELECT publisher_id, name FROM Publisher")
+        self.publisher_ids = {row["name"]: row["publisher_id"]
+                              for row in rows}
+
+        rows = cur.execute("""
+                           SELECT author_id, last_name, remaining_name
+                           FROM Author
+                           """)
+        self.author_ids = {(row["last_name"], row["remaining_name"]):
+                           row["author_id"] for row in rows}
+
+        self.loaded = True
+
+    def commit(self) -> None:
+        self.publisher_ids.update(self._new_publisher_ids)
+        self.author_ids.update(self._new_author_ids)
+        self.rollback()
+
+    def rollback(self) -> None:
+        self._new_publisher_ids = {}
+        self._new_author_ids = {}
+
+    def resolve_publishers(self, cur, publishers: dict[str, Publisher]
+                           ) -> dict[str, int]:
+        """Map publisher names to ids, inserting the unknown ones"""
+
+        ids = {}
+        missing = []
+        for name, publisher in publishers.items():
+            publisher_id = (self.publisher_ids.get(name)
+                            or self._new_publisher_ids.get(name))
+            if publisher_id is None:
+                missing.append(publisher)
+            else:
+                ids[name] = publisher_id
+
+        if not missing:
+            return ids
+
+        cur.executemany("""
+                        INSERT OR IGNORE INTO Publisher
+                        VALUES(NULL, ?, ?, ?, ?)
+                        """, [(publisher.name, publisher.address,
+                               publisher.url, publisher.created_at)
+                              for publisher in missing])
+
+        rows = cur.execute("""
+                           SELECT publisher_id, name FROM Publisher
+                           WHERE name IN (SELECT value FROM json_each(?))
+                           """, (json.dumps([publisher.name
+                                             for publisher in missing]),))
+
+        for row in rows:
+            ids[row["name"]] = row["publisher_id"]
+            self._new_publisher_ids[row["name"]] = row["publisher_id"]
+
+        return ids
+
+    def resolve_authors(self, cur, authors: dict[tuple, Author]
+                        ) -> dict[tuple, int]:
+        """Map author names to ids, inserting the unknown ones"""
+
+        ids = {}
+        unknown = []
+        for key in authors:
+            author_id = (self.author_ids.get(key)
+                         or self._new_author_ids.get(key))
+            if author_id is None:
+                unknown.append(key)
+            else:
+                ids[key] = author_id
+
+        if not unknown:
+            return ids
+
+        # Another writer may have stored some of them since the preload.
+        found = self._select_author_ids(cur, unknown)
+        missing = [authors[key] for key in unknown if key not in found]
+
+        if missing:
+            cur.executemany("""
+                            INSERT INTO Author
+                            VALUES(NULL, ?, ?, ?, ?, ?, ?, ?)
+                            """, [(author.last_name, author.remaining_name,
+                                   author.birth_date, author.email,
+                                   author.social_url, author.nationality,
+                                   author.created_at)
+                                  for author in missing])
+
+            found.update(self._select_author_ids(
+                cur, [_author_key(author) for author in missing]))
+
+        ids.update(found)
+        self._new_author_ids.update(found)
+        return ids
+
+    def _select_author_ids(self, cur, keys: list[tuple]) -> dict[tuple, int]:
+        # The batch drives the join, as in BulkIngestor._write_documents.
+        rows = cur.execute("""
+                           SELECT Author.author_id, Author.last_name,
+                                  Author.remaining_name
+                           FROM json_each(?) AS k
+                           CROSS JOIN Author
+                               ON Author.last_name
+                                   IS json_extract(k.value, '$[0]')
+                               AND Author.remaining_name
+                                   IS json_extract(k.value, '$[1]')
+                           """, (json.dumps(keys),))
+
+        return {(row["last_name"], row["remaining_name"]): row["author_id"]
+                for row in rows}
+
+
+def _chunks(items: Iterable, size: int) -> Iterator[list]:
+    iterator = iter(items)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+def _author_key(author) -> tuple:
+    return (author.last_name, author.remaining_name)
+
+
+def _type(document: Document) -> str:
+    return "book" if isinstance(document, Book) else "paper"
+
+
+def _publisher_id(document: Document,
+                  publisher_ids: dict[str, int]) -> int | None:
+    if document.publisher is None:
+        return None
+    return publisher_ids.get(document.publisher.name)
@@ -0,0 +1,83 @@
+import threading
+from functools import wraps
+from typing import Any, Callable
+
+
+class BatchLoader:
+    """Loads a relation for every document of a result set at once
+
+    Each document gets a LazyList from add(). The first time any of them
+    is used, `load` is called once with the ids of all of them and every
+    list is filled from the dict it returns.
+    """
+
+    def __init__(self, load: Callable[[list[int]], dict[int, list]]):
+        self._load = load
+        self._lists: list["LazyList"] = []
+        self._lock = threading.Lock()
+
+    def add(self, document_id: int) -> "LazyList":
+        lazy_list = LazyList(loader=self, document_id=document_id)
+        self._lists.append(lazy_list)
+        return lazy_list
+
+    def load(self) -> None:
+        with self._lock:
+            if not self._lists:
+                return None
+
+            values = self._load([lazy_list.document_id
+                                 for lazy_list in self._lists])
+            for lazy_list in self._lists:
+                lazy_list._fill(values.get(lazy_list.document_id, []))
+
+            # Loaded lists no longer need the loader, nor it them.
+            self._lists = []
+
+
+class LazyList(list):
+    """A list whose items are only fetched when it is first used"""
+
+    __slots__ = ("document_id", "_loader")
+
+    def __init__(self, iterable=(), loader: BatchLoader | None = None,
+                 document_id: int | None = None):
+        super().__init__(iterable)
+        self.document_id = document_id
+        self._loader = loader
+
+    def _fill(self, items: list) -> None:
+        list.extend(self, items)
+        self._loader = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._loader is None
+
+    def __reduce__(self) -> tuple:
+        # Pickled (and copied) as the plain list of its items, loaded
+        # first, rather than dragging along the loader with its lock and
+        # every other list of the result set.
+        return list, (list(self),)
+
+
+def _loading(method: Callable) -> Callable:
+    @wraps(method)
+    def load_first(self: LazyList, *args, **kwargs) -> Any:
+        # list methods read the items of another list directly, so one
+        # being compared with or added to this one is loaded as well.
+        for value in (self, *args):
+            if isinstance(value, LazyList) and value._loader is not None:
+                value._loader.load()
+        return method(self, *args, **kwargs)
+
+    return load_first
+
+
+for name in ("__len__", "__iter__", "__reversed__", "__getitem__",
+             "__contains__", "__eq__", "__ne__", "__lt__", "__le__",
+             "__gt__", "__ge__", "__add__", "__mul__", "__rmul__",
+             "__repr__", "__setitem__", "__delitem__", "__iadd__",
+             "__imul__", "append", "extend", "insert", "remove", "pop",
+             "clear", "index", "count", "sort", "reverse", "copy"):
+    setattr(LazyList, name, _loading(getattr(list, name)))
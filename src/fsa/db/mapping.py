@@ -0,0 +1,88 @@
+from operator import attrgetter
+from typing import Any, Callable
+from ..domain import Paper, Author, Publisher, Book, Document, User
+
+
+class RowMapping:
+    """Maps a fixed column list to the fields of a domain class
+
+    Reads and writes are code generated once per mapping: read() builds
+    the object from row positions and params() returns the flat tuple of
+    its fields, so neither goes through dicts or dataclasses.asdict. A
+    None in `fields` skips that column of the row.
+    """
+
+    def __init__(self, cls: type, fields: tuple[str | None, ...],
+                 defaults: dict[str, str] | None = None):
+        self.cls = cls
+        self.fields = fields
+        self.read = _make_reader(cls, fields, defaults or {})
+        self.params: Callable[[Any], tuple] = attrgetter(
+            *[name for name in fields if name])
+
+    def columns(self, table: str) -> str:
+        """The mapped columns of a table, ready for a SELECT"""
+
+        return ", ".join(f"{table}.{name}" for name in self.fields if name)
+
+    @property
+    def placeholders(self) -> str:
+        return ", ".join("?" for name in self.fields if name)
+
+
+def _make_reader(cls: type, fields: tuple[str | None, ...],
+                 defaults: dict[str, str]) -> Callable[..., Any]:
+    args = [f"{name}=row[offset + {index}]"
+            for index, name in enumerate(fields) if name]
+    args += [f"{name}={value}" for name, value in defaults.items()]
+
+    source = (f"def read(row, offset=0):\n"
+              f"    return cls({', '.join(args)})\n")
+    namespace = {"cls": cls}
+    exec(source, namespace)
+    return namespace["read"]
+
+
+USER = RowMapping(User, ("user_id", "username", "password", "email",
+                         "date_joined"))
+
+PUBLISHER = RowMapping(Publisher, ("publisher_id", "name", "address", "url",
+                                   "created_at"),
+                       {"document_ids": "[]"})
+
+AUTHOR = RowMapping(Author, ("author_id", "last_name", "remaining_name",
+                             "birth_date", "email", "social_url",
+                             "nationality", "created_at"),
+                    {"document_ids": "[]"})
+
+# Rows of the Document, Book and Paper tables, for writes.
+DOCUMENT = RowMapping(Document, ("document_id", "title", "language", "year",
+                                 "abstract", "content_hash", "created_at"),
+                      {"tags": "[]", "publisher": "None"})
+BOOK = RowMapping(Book, ("document_id", "isbn", "edition",
+                         "publication_place"))
+PAPER = RowMapping(Paper, ("document_id", "doi", "journal", "issue", "pages",
+                           "volume"))
+
+# A DocumentView row: the document with its Book, Paper and Publisher
+# columns, then the JSON arrays of its authors (each one in AUTHOR order)
+# and of its tags.
+_BOOK_FIELDS = BOOK.fields[1:]
+_PAPER_FIELDS = PAPER.fields[1:]
+
+VIEW_COLUMNS = ", ".join([
+    ", ".join(name for name in DOCUMENT.fields + _BOOK_FIELDS + _PAPER_FIELDS),
+    "type, publisher_id, publisher_name, publisher_address, publisher_url",
+    "publisher_created_at, authors, tags",
+])
+TYPE_INDEX = len(DOCUMENT.fields) + len(_BOOK_FIELDS) + len(_PAPER_FIELDS)
+PUBLISHER_OFFSET = TYPE_INDEX + 1
+AUTHORS_INDEX = PUBLISHER_OFFSET + len(PUBLISHER.fields)
+TAGS_INDEX = AUTHORS_INDEX + 1
+
+JOINED_BOOK = RowMapping(
+    Book, DOCUMENT.fields + _BOOK_FIELDS + (None,) * len(_PAPER_FIELDS),
+    {"tags": "[]", "publisher": "None"})
+JOINED_PAPER = RowMapping(
+    Paper, DOCUMENT.fields + (None,) * len(_BOOK_FIELDS) + _PAPER_FIELDS,
+    {"tags": "[]", "publisher": "None"})
@@ -0,0 +1,759 @@
+import json
+from typing import Callable
+from sqlite3 import Connection, Cursor
+
+
+def _add_column(cur: Cursor, table: str, column: str, definition: str) -> None:
+    """Add a column unless a table created with it already has it"""
+
+    rows = cur.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in rows]:
+        cur.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+def _rebuild_table(cur: Cursor, table: str, definition: str) -> None:
+    """Recreate a table with a new definition, keeping its rows
+
+    Used for changes ALTER TABLE cannot make, such as foreign key actions.
+    Foreign key enforcement must be off while it runs.
+    """
+
+    cur.execute(f"CREATE TABLE {table}_new {definition}")
+    cur.execute(f"INSERT INTO {table}_new SELECT * FROM {table}")
+    cur.execute(f"DROP TABLE {table}")
+    cur.execute(f"ALTER TABLE {table}_new RENAME TO {table}")
+
+
+def initial_schema(cur: Cursor) -> None:
+    cur.execute("""CREATE TABLE IF NOT EXISTS Publisher (
+                    publisher_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    address TEXT,
+                    url TEXT,
+                    created_at DATE
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS User (
+                    user_id INTEGER PRIMARY KEY,
+                    username TEXT NOT NULL UNIQUE,
+                    password TEXT NOT NULL,
+                    email TEXT NOT NULL UNIQUE,
+                    date_joined DATE
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Document (
+                    document_id INTEGER PRIMARY KEY,
+                    title TEXT NOT NULL,
+                    language TEXT,
+                    year INTEGER,
+                    publisher_id INTEGER,
+                    created_at DATE,
+                    type TEXT CHECK(type IN ('book', 'paper')),
+                    user_id INTEGER,
+                    UNIQUE(title, year)
+                    FOREIGN KEY (publisher_id) REFERENCES Publisher (publisher_id)
+                        ON DELETE SET NULL
+                    FOREIGN KEY (user_id) REFERENCES User (user_id)
+                        ON DELETE SET NULL
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Book (
+                    document_id INTEGER PRIMARY KEY,
+                    isbn TEXT UNIQUE,
+                    edition TEXT,
+                    publication_place TEXT,
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Paper (
+                    document_id INTEGER PRIMARY KEY,
+                    doi TEXT UNIQUE,
+                    journal TEXT,
+                    issue TEXT,
+                    pages TEXT,
+                    volume TEXT,
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Author (
+                    author_id INTEGER PRIMARY KEY,
+                    last_name TEXT,
+                    remaining_name TEXT,
+                    birth_date DATE,
+                    email TEXT,
+                    social_url TEXT,
+                    nationality TEXT,
+                    created_at DATE,
+                    UNIQUE(last_name, remaining_name)
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Writes (
+                    document_id INTEGER,
+                    author_id INTEGER,
+                    PRIMARY KEY (document_id, author_id)
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id),
+                    FOREIGN KEY (author_id) REFERENCES Author (author_id)
+                    )""")
+
+
+def add_content_hash(cur: Cursor) -> None:
+    _add_column(cur, "Document", "content_hash", "TEXT")
+
+
+def add_import_log(cur: Cursor) -> None:
+    cur.execute("""CREATE TABLE IF NOT EXISTS ImportLog (
+                    import_id INTEGER PRIMARY KEY,
+                    source_path TEXT,
+                    source_hash TEXT NOT NULL UNIQUE,
+                    record_offset INTEGER NOT NULL DEFAULT 0,
+                    inserted_count INTEGER NOT NULL DEFAULT 0,
+                    status TEXT CHECK(status IN ('running', 'complete')),
+                    started_at DATE,
+                    finished_at DATE
+                    )""")
+
+
+def cascade_document_links(cur: Cursor) -> None:
+    """Delete Book, Paper and Writes rows along with what they refer to"""
+
+    _rebuild_table(cur, "Book", """(
+                    document_id INTEGER PRIMARY KEY,
+                    isbn TEXT UNIQUE,
+                    edition TEXT,
+                    publication_place TEXT,
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                        ON DELETE CASCADE
+                    )""")
+
+    _rebuild_table(cur, "Paper", """(
+                    document_id INTEGER PRIMARY KEY,
+                    doi TEXT UNIQUE,
+                    journal TEXT,
+                    issue TEXT,
+                    pages TEXT,
+                    volume TEXT,
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                        ON DELETE CASCADE
+                    )""")
+
+    _rebuild_table(cur, "Writes", """(
+                    document_id INTEGER,
+                    author_id INTEGER,
+                    PRIMARY KEY (document_id, author_id)
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                        ON DELETE CASCADE,
+                    FOREIGN KEY (author_id) REFERENCES Author (author_id)
+                        ON DELETE CASCADE
+                    )""")
+
+
+def add_access_path_indexes(cur: Cursor) -> None:
+    """Index every column DBHandler looks rows up by
+
+    Author.last_name, Publisher.name and Document(title, year) are already
+    covered by the indexes behind their UNIQUE constraints.
+    """
+
+    # Documents of an author, and the cascade when an author is deleted.
+    cur.execute("""CREATE INDEX IF NOT EXISTS Writes_author_id
+                    ON Writes (author_id, document_id)""")
+
+    # Documents of a publisher or user, and their ON DELETE SET NULL.
+    cur.execute("""CREATE INDEX IF NOT EXISTS Document_publisher_id
+                    ON Document (publisher_id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS Document_user_id
+                    ON Document (user_id)""")
+
+    # Book and paper listings in id order, answered from the index alone
+    # when only titles are needed.
+    cur.execute("""CREATE INDEX IF NOT EXISTS Document_type
+                    ON Document (type, document_id, title)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS Document_year
+                    ON Document (year)""")
+
+
+def add_full_text_search(cur: Cursor) -> None:
+    """Store abstracts and index titles, abstracts and journals with FTS5
+
+    DocumentSearch keeps its own copy of the text under rowid = document_id
+    and the triggers below keep it in step with Document and Paper.
+    """
+
+    _add_column(cur, "Document", "abstract", "TEXT")
+
+    cur.execute("""CREATE VIRTUAL TABLE IF NOT EXISTS DocumentSearch
+                    USING fts5(title, abstract, journal,
+                               tokenize = 'unicode61 remove_diacritics 2')""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Document_search_insert
+                    AFTER INSERT ON Document
+                    BEGIN
+                        INSERT INTO DocumentSearch (rowid, title, abstract)
+                        VALUES (new.document_id, new.title, new.abstract);
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Document_search_update
+                    AFTER UPDATE OF title, abstract ON Document
+                    WHEN old.title IS NOT new.title
+                        OR old.abstract IS NOT new.abstract
+                    BEGIN
+                        UPDATE DocumentSearch
+                        SET title = new.title, abstract = new.abstract
+                        WHERE rowid = new.document_id;
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Document_search_delete
+                    AFTER DELETE ON Document
+                    BEGIN
+                        DELETE FROM DocumentSearch
+                        WHERE rowid = old.document_id;
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Paper_search_insert
+                    AFTER INSERT ON Paper
+                    BEGIN
+                        UPDATE DocumentSearch
+                        SET journal = new.journal
+                        WHERE rowid = new.document_id;
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Paper_search_update
+                    AFTER UPDATE OF journal ON Paper
+                    WHEN old.journal IS NOT new.journal
+                    BEGIN
+                        UPDATE DocumentSearch
+                        SET journal = new.journal
+                        WHERE rowid = new.document_id;
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS Paper_search_delete
+                    AFTER DELETE ON Paper
+                    BEGIN
+                        UPDATE DocumentSearch
+                        SET journal = NULL
+                        WHERE rowid = old.document_id;
+                    END""")
+
+    cur.execute("""INSERT INTO DocumentSearch (rowid, title, abstract, journal)
+                    SELECT Document.document_id, Document.title,
+                           Document.abstract, Paper.journal
+                    FROM Document
+                    LEFT JOIN Paper
+                        ON Document.document_id = Paper.document_id""")
+
+
+def add_tags(cur: Cursor) -> None:
+    """Store document tags, indexed both ways, with a count per tag
+
+    Tag.document_count is kept by triggers on DocumentTag, so tag counts
+    are read without touching the links.
+    """
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS Tag (
+                    tag_id INTEGER PRIMARY KEY,
+                    name TEXT NOT NULL UNIQUE,
+                    document_count INTEGER NOT NULL DEFAULT 0
+                    )""")
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS DocumentTag (
+                    document_id INTEGER,
+                    tag_id INTEGER,
+                    PRIMARY KEY (document_id, tag_id)
+                    FOREIGN KEY (document_id) REFERENCES Document (document_id)
+                        ON DELETE CASCADE,
+                    FOREIGN KEY (tag_id) REFERENCES Tag (tag_id)
+                        ON DELETE CASCADE
+                    )""")
+
+    # The inverted index: documents by tag.
+    cur.execute("""CREATE INDEX IF NOT EXISTS DocumentTag_tag_id
+                    ON DocumentTag (tag_id, document_id)""")
+    cur.execute("""CREATE INDEX IF NOT EXISTS Tag_document_count
+                    ON Tag (document_count DESC, name)""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS DocumentTag_count_insert
+                    AFTER INSERT ON DocumentTag
+                    BEGIN
+                        UPDATE Tag
+                        SET document_count = document_count + 1
+                        WHERE tag_id = new.tag_id;
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS DocumentTag_count_delete
+                    AFTER DELETE ON DocumentTag
+                    BEGIN
+                        UPDATE Tag
+                        SET document_count = document_count - 1
+                        WHERE tag_id = old.tag_id;
+                    END""")
+
+
+# Fragments of the DocumentView triggers, for the document {id}.
+_VIEW_AUTHORS = """(
+    SELECT json_group_array(json(author)) FROM (
+        SELECT json_array(Author.author_id, Author.last_name,
+                          Author.remaining_name, Author.birth_date,
+                          Author.email, Author.social_url,
+                          Author.nationality, Author.created_at) AS author
+        FROM Writes
+        INNER JOIN Author
+            ON Writes.author_id = Author.author_id
+        WHERE Writes.document_id = {id}
+        ORDER BY Writes.rowid))"""
+
+_VIEW_TAGS = """(
+    SELECT json_group_array(name) FROM (
+        SELECT Tag.name
+        FROM DocumentTag
+        INNER JOIN Tag
+            ON DocumentTag.tag_id = Tag.tag_id
+        WHERE DocumentTag.document_id = {id}
+        ORDER BY Tag.name))"""
+
+_VIEW_ROW = """
+    SELECT Document.document_id, Document.title, Document.language,
+           Document.year, Document.abstract, Document.content_hash,
+           Document.created_at, Book.isbn, Book.edition,
+           Book.publication_place, Paper.doi, Paper.journal, Paper.issue,
+           Paper.pages, Paper.volume, Document.type, Publisher.publisher_id,
+           Publisher.name, Publisher.address, Publisher.url,
+           Publisher.created_at, {authors}, {tags}
+    FROM Document
+    LEFT JOIN Publisher
+        ON Document.publisher_id = Publisher.publisher_id
+    LEFT JOIN Book
+        ON Document.document_id = Book.document_id
+    LEFT JOIN Paper
+        ON Document.document_id = Paper.document_id
+    WHERE {where}"""
+
+
+def _view_row(id: str, where: str) -> str:
+    return _VIEW_ROW.format(authors=_VIEW_AUTHORS.format(id=id),
+                            tags=_VIEW_TAGS.format(id=id), where=where)
+
+
+def _create_document_view_triggers(cur: Cursor, when: str = "") -> None:
+    """(Re)create the DocumentView triggers on a document's own rows
+
+    Those of Document inserts and updates, of Book and Paper, and of the
+    Writes and DocumentTag links, each fired only `when` is true.
+    """
+
+    def create(name: str, event: str, body: str) -> None:
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute(f"""CREATE TRIGGER {name}
+                        {event}
+                        {when}
+                        BEGIN
+                            {body};
+                        END""")
+
+    # Trigger statements take their conflict handling from the statement
+    # that fired them (an ON DELETE SET NULL has none), so rows are
+    # replaced by deleting them first rather than with INSERT OR REPLACE.
+    refresh = "INSERT INTO DocumentView" + _view_row(
+        "new.document_id", "Document.document_id = new.document_id")
+
+    create("DocumentView_document_insert", "AFTER INSERT ON Document",
+           refresh)
+
+    create("DocumentView_document_update",
+           """AFTER UPDATE OF title, language, year, abstract,
+                  content_hash, created_at, type, publisher_id
+              ON Document""",
+           f"""DELETE FROM DocumentView
+               WHERE document_id = new.document_id;
+               {refresh}""")
+
+    subtypes = {
+        "Book": ["isbn", "edition", "publication_place"],
+        "Paper": ["doi", "journal", "issue", "pages", "volume"],
+    }
+    for table, columns in subtypes.items():
+        for event, row in [("INSERT", "new"), ("UPDATE", "new"),
+                           ("DELETE", "old")]:
+            values = ", ".join(
+                f"{column} = {'NULL' if row == 'old' else 'new.' + column}"
+                for column in columns)
+            create(f"DocumentView_{table.lower()}_{event.lower()}",
+                   f"AFTER {event} ON {table}",
+                   f"""UPDATE DocumentView
+                       SET {values}
+                       WHERE document_id = {row}.document_id""")
+
+    for table, column, builder in [("Writes", "authors", _VIEW_AUTHORS),
+                                   ("DocumentTag", "tags", _VIEW_TAGS)]:
+        for event, row in [("INSERT", "new"), ("DELETE", "old")]:
+            create(f"DocumentView_{table.lower()}_{event.lower()}",
+                   f"AFTER {event} ON {table}",
+                   f"""UPDATE DocumentView
+                       SET {column} = {builder.format(
+                           id=row + ".document_id")}
+                       WHERE document_id = {row}.document_id""")
+
+
+def refresh_document_view(cur: Cursor, document_ids: list[int]) -> None:
+    """Rebuild the DocumentView rows of some documents in two statements
+
+    For writers that pause the per-row triggers with DocumentViewPaused.
+    """
+
+    ids = json.dumps(document_ids)
+    cur.execute("""DELETE FROM DocumentView
+                   WHERE document_id IN (SELECT value FROM json_each(?))""",
+                (ids,))
+    cur.execute("INSERT INTO DocumentView" + _view_row(
+        "Document.document_id",
+        "Document.document_id IN (SELECT value FROM json_each(?))"), (ids,))
+
+
+def add_document_view(cur: Cursor) -> None:
+    """Keep every document fully assembled in one DocumentView row
+
+    Authors (in link order) and tags are stored as JSON arrays. Triggers
+    on every table a document is assembled from keep the rows current;
+    updates that change nothing, like the no-op upserts of existing
+    authors and publishers, leave the view alone.
+    """
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS DocumentView (
+                    document_id INTEGER PRIMARY KEY,
+                    title TEXT,
+                    language TEXT,
+                    year INTEGER,
+                    abstract TEXT,
+                    content_hash TEXT,
+                    created_at DATE,
+                    isbn TEXT,
+                    edition TEXT,
+                    publication_place TEXT,
+                    doi TEXT,
+                    journal TEXT,
+                    issue TEXT,
+                    pages TEXT,
+                    volume TEXT,
+                    type TEXT,
+                    publisher_id INTEGER,
+                    publisher_name TEXT,
+                    publisher_address TEXT,
+                    publisher_url TEXT,
+                    publisher_created_at DATE,
+                    authors TEXT NOT NULL DEFAULT '[]',
+                    tags TEXT NOT NULL DEFAULT '[]'
+                    )""")
+
+    cur.execute("""CREATE INDEX IF NOT EXISTS DocumentView_publisher_id
+                    ON DocumentView (publisher_id)""")
+
+    _create_document_view_triggers(cur)
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS DocumentView_document_delete
+                    AFTER DELETE ON Document
+                    BEGIN
+                        DELETE FROM DocumentView
+                        WHERE document_id = old.document_id;
+                    END""")
+
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS DocumentView_author_update
+                    AFTER UPDATE ON Author
+                    WHEN old.last_name IS NOT new.last_name
+                        OR old.remaining_name IS NOT new.remaining_name
+                        OR old.birth_date IS NOT new.birth_date
+                        OR old.email IS NOT new.email
+                        OR old.social_url IS NOT new.social_url
+                        OR old.nationality IS NOT new.nationality
+                        OR old.created_at IS NOT new.created_at
+                    BEGIN
+                        UPDATE DocumentView
+                        SET authors = {_VIEW_AUTHORS.format(
+                            id="DocumentView.document_id")}
+                        WHERE document_id IN (
+                            SELECT document_id FROM Writes
+                            WHERE author_id = new.author_id);
+                    END""")
+
+    cur.execute("""CREATE TRIGGER IF NOT EXISTS DocumentView_publisher_update
+                    AFTER UPDATE ON Publisher
+                    WHEN old.name IS NOT new.name
+                        OR old.address IS NOT new.address
+                        OR old.url IS NOT new.url
+                        OR old.created_at IS NOT new.created_at
+                    BEGIN
+                        UPDATE DocumentView
+                        SET publisher_name = new.name,
+                            publisher_address = new.address,
+                            publisher_url = new.url,
+                            publisher_created_at = new.created_at
+                        WHERE publisher_id = new.publisher_id;
+                    END""")
+
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS DocumentView_tag_update
+                    AFTER UPDATE OF name ON Tag
+                    WHEN old.name IS NOT new.name
+                    BEGIN
+                        UPDATE DocumentView
+                        SET tags = {_VIEW_TAGS.format(
+                            id="DocumentView.document_id")}
+                        WHERE document_id IN (
+                            SELECT document_id FROM DocumentTag
+                            WHERE tag_id = new.tag_id);
+                    END""")
+
+    cur.execute("DELETE FROM DocumentView")
+    cur.execute("INSERT INTO DocumentView" + _view_row(
+        "Document.document_id", "true"))
+
+
+# The Document column counted by each DocumentStat dimension; "author" is
+# counted from Writes instead.
+STAT_COLUMNS = {
+    "year": "year",
+    "language": "language",
+    "type": "type",
+    "publisher": "publisher_id",
+}
+
+_STAT_ADD = """
+    INSERT INTO DocumentStat (dimension, value, document_count)
+    SELECT '{dimension}', {value}, 1 WHERE {value} IS NOT NULL
+    ON CONFLICT DO UPDATE SET document_count = document_count + 1"""
+
+_STAT_REMOVE = """
+    UPDATE DocumentStat SET document_count = document_count - 1
+    WHERE dimension = '{dimension}' AND value = {value}"""
+
+
+def _create_stat_insert_triggers(cur: Cursor, when: str = "") -> None:
+    """(Re)create the DocumentStat triggers on Document and Writes inserts,
+    fired only `when` is true"""
+
+    add = ";".join(_STAT_ADD.format(dimension=dimension,
+                                    value=f"new.{column}")
+                   for dimension, column in STAT_COLUMNS.items())
+
+    for name, table, body in [
+            ("DocumentStat_document_insert", "Document", add),
+            ("DocumentStat_writes_insert", "Writes",
+             _STAT_ADD.format(dimension="author", value="new.author_id"))]:
+        cur.execute(f"DROP TRIGGER IF EXISTS {name}")
+        cur.execute(f"""CREATE TRIGGER {name}
+                        AFTER INSERT ON {table}
+                        {when}
+                        BEGIN
+                            {body};
+                        END""")
+
+
+def count_documents(cur: Cursor, document_ids: list[int],
+                    author_ids: list[int]) -> None:
+    """Add inserted documents, and the authors of inserted links, to
+    DocumentStat in one statement per dimension
+
+    For writers that pause the insert triggers with DocumentStatPaused.
+    """
+
+    for dimension, column in STAT_COLUMNS.items():
+        cur.execute(f"""INSERT INTO DocumentStat
+                        SELECT '{dimension}', {column}, count(*)
+                        FROM Document
+                        WHERE document_id IN (SELECT value FROM json_each(?))
+                            AND {column} IS NOT NULL
+                        GROUP BY {column}
+                        ON CONFLICT DO UPDATE SET document_count =
+                            document_count + excluded.document_count""",
+                    (json.dumps(document_ids),))
+
+    cur.execute("""INSERT INTO DocumentStat
+                    SELECT 'author', value, count(*)
+                    FROM json_each(?)
+                    WHERE true
+                    GROUP BY value
+                    ON CONFLICT DO UPDATE SET document_count =
+                        document_count + excluded.document_count""",
+                (json.dumps(author_ids),))
+
+
+def add_document_stats(cur: Cursor) -> None:
+    """Count documents per year, language, type, publisher and author
+
+    DocumentStat holds one counter per dimension and value, adjusted by
+    triggers as documents and author links are written, so aggregates are
+    read without scanning Document. NULL values are not counted.
+    """
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS DocumentStat (
+                    dimension TEXT,
+                    value,
+                    document_count INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (dimension, value)
+                    ) WITHOUT ROWID""")
+
+    cur.execute("""CREATE INDEX IF NOT EXISTS DocumentStat_document_count
+                    ON DocumentStat (dimension, document_count DESC, value)""")
+
+    def remove(row: str) -> str:
+        return ";".join(_STAT_REMOVE.format(dimension=dimension,
+                                            value=f"{row}.{column}")
+                        for dimension, column in STAT_COLUMNS.items())
+
+    _create_stat_insert_triggers(cur)
+
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS DocumentStat_document_delete
+                    AFTER DELETE ON Document
+                    BEGIN
+                        {remove("old")};
+                    END""")
+
+    for dimension, column in STAT_COLUMNS.items():
+        cur.execute(f"""CREATE TRIGGER IF NOT EXISTS
+                            DocumentStat_document_{dimension}
+                        AFTER UPDATE OF {column} ON Document
+                        WHEN old.{column} IS NOT new.{column}
+                        BEGIN
+                            {_STAT_REMOVE.format(dimension=dimension,
+                                                 value="old." + column)};
+                            {_STAT_ADD.format(dimension=dimension,
+                                              value="new." + column)};
+                        END""")
+
+    cur.execute(f"""CREATE TRIGGER IF NOT EXISTS DocumentStat_writes_delete
+                    AFTER DELETE ON Writes
+                    BEGIN
+                        {_STAT_REMOVE.format(dimension="author",
+                                             value="old.author_id")};
+                    END""")
+
+    cur.execute("DELETE FROM DocumentStat")
+    for dimension, column in STAT_COLUMNS.items():
+        cur.execute(f"""INSERT INTO DocumentStat
+                        SELECT '{dimension}', {column}, count(*)
+                        FROM Document
+                        WHERE {column} IS NOT NULL
+                        GROUP BY {column}""")
+    cur.execute("""INSERT INTO DocumentStat
+                    SELECT 'author', author_id, count(*)
+                    FROM Writes
+                    WHERE author_id IS NOT NULL
+                    GROUP BY author_id""")
+
+
+def pause_document_view_triggers(cur: Cursor) -> None:
+    """Let bulk writers refresh DocumentView once per batch
+
+    While DocumentViewPaused has a row, the triggers on a document's own
+    rows leave the view alone. A writer adds the row at the start of its
+    transaction, calls refresh_document_view() for the documents it wrote
+    and deletes the row before committing, so no other connection ever
+    sees it. Author, Publisher and Tag updates keep refreshing the view.
+    """
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS DocumentViewPaused (
+                    paused INTEGER PRIMARY KEY
+                    )""")
+
+    _create_document_view_triggers(
+        cur, "WHEN NOT EXISTS (SELECT 1 FROM DocumentViewPaused)")
+
+
+def pause_document_stat_triggers(cur: Cursor) -> None:
+    """Let bulk writers count the documents of a batch at once
+
+    Like DocumentViewPaused: while DocumentStatPaused has a row, inserts
+    into Document and Writes leave DocumentStat alone, and the writer
+    calls count_documents() before deleting the row again. Updates and
+    deletes keep adjusting the counters through their triggers.
+    """
+
+    cur.execute("""CREATE TABLE IF NOT EXISTS DocumentStatPaused (
+                    paused INTEGER PRIMARY KEY
+                    )""")
+
+    _create_stat_insert_triggers(
+        cur, "WHEN NOT EXISTS (SELECT 1 FROM DocumentStatPaused)")
+
+
+def add_tag_sources(cur: Cursor) -> None:
+    """Record whether a document was tagged by a user or by an import
+
+    A re-import only replaces the links that came from the CSL keyword
+    field. Links made before sources were recorded count as user links,
+    so a re-import never drops them.
+    """
+
+    _add_column(cur, "DocumentTag", "source",
+                "TEXT NOT NULL DEFAULT 'user'")
+
+
+def add_author_link_sources(cur: Cursor) -> None:
+    """Record whether an author was linked by a user or by an import
+
+    Like DocumentTag.source: a re-import only removes the links it made.
+    """
+
+    _add_column(cur, "Writes", "source", "TEXT NOT NULL DEFAULT 'user'")
+
+
+# Applied in order; a database at PRAGMA user_version N has run the first
+# N of them. Only ever append to this list.
+MIGRATIONS: list[Callable[[Cursor], None]] = [
+    initial_schema,
+    add_content_hash,
+    add_import_log,
+    cascade_document_links,
+    add_access_path_indexes,
+    add_full_text_search,
+    add_tags,
+    add_document_view,
+    add_document_stats,
+    pause_document_view_triggers,
+    pause_document_stat_triggers,
+    add_tag_sources,
+    add_author_link_sources,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def migrate(con: Connection) -> None:
+    """Bring a database up to SCHEMA_VERSION
+
+    Each pending migration runs in its own transaction together with the
+    user_version bump, so it is applied exactly once. A database that is
+    already current costs a single PRAGMA read.
+    """
+
+    version = con.execute("PRAGMA user_version").fetchone()[0]
+    if version >= SCHEMA_VERSION:
+        return
+
+    foreign_keys = con.execute("PRAGMA foreign_keys").fetchone()[0]
+    con.commit()
+    con.execute("PRAGMA foreign_keys = 0")
+
+    cur = con.cursor()
+    try:
+        for number in range(version + 1, SCHEMA_VERSION + 1):
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # Another process may have migrated the file since the
+                # version was read, so it is read again under the lock.
+                applied = cur.execute("PRAGMA user_version").fetchone()[0]
+                if applied >= number:
+                    con.rollback()
+                    continue
+
+                MIGRATIONS[number - 1](cur)
+
+                violations = cur.execute("PRAGMA foreign_key_check")
+                if violations.fetchone():
+                    raise RuntimeError(
+                        f"Migration {number} broke foreign key constraints.")
+
+                cur.execute(f"PRAGMA user_version = {number}")
+                con.commit()
+            except BaseException:
+                con.rollback()
+                raise
+    finally:
+        con.execute(f"PRAGMA foreign_keys = {foreign_keys}")
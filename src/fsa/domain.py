@@ -1,18 +1,16 @@
-from typing import Any, Self
+from typing import NamedTuple, Self
 from datetime import datetime
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass, field
+from . import csl
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class User:
     user_id: int | None = None
     username: str
     password: str
     email: str
-    date_joined: datetime = datetime.now()
-
-    def get_parsed_dict(self) -> dict[str, Any]:
-        return asdict(self)
+    date_joined: datetime = field(default_factory=datetime.now)
 
     @classmethod
     def from_raw_data(cls, data: dict) -> Self:
@@ -22,28 +20,15 @@ class User:
             email=data.get("email")
         )
 
-    @classmethod
-    def from_db_row(cls, row: dict) -> Self:
-        return User(
-            user_id=row.get("user_id"),
-            username=row.get("username"),
-            password=row.get("password"),
-            email=row.get("email"),
-            date_joined=row.get("date_joined")
-        )
-
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Publisher:
     publisher_id: int | None = None
     name: str
     address: str | None = None
     url: str | None = None
     document_ids: list[int] | None = None
-    created_at: datetime = datetime.now()
-
-    def get_parsed_dict(self) -> dict[str, Any]:
-        return asdict(self)
+    created_at: datetime = field(default_factory=datetime.now)
 
     @classmethod
     def from_raw_data(cls, data: dict) -> Self:
@@ -54,19 +39,8 @@ class Publisher:
             document_ids=[],
         )
 
-    @classmethod
-    def from_db_row(cls, row: dict) -> Self:
-        return Publisher(
-            publisher_id=row.get("publisher_id"),
-            name=row.get("name", ""),
-            address=row.get("address"),
-            url=row.get("url"),
-            document_ids=[],
-            created_at=row.get("pub_created_at", datetime.now())
-        )
-
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Author:
     author_id: int | None = None
     remaining_name: str
@@ -76,10 +50,7 @@ class Author:
     social_url: str | None
     nationality: str | None
     document_ids: list[int] | None = None
-    created_at: datetime = datetime.now()
-
-    def get_parsed_dict(self) -> dict[str, Any]:
-        return asdict(self)
+    created_at: datetime = field(default_factory=datetime.now)
 
     @classmethod
     def from_raw_data(cls, data: dict) -> Self:
@@ -94,22 +65,8 @@ class Author:
             document_ids=[]
         )
 
-    @classmethod
-    def from_db_row(cls, row: dict) -> Self:
-        return Author(
-            author_id=row.get("author_id"),
-            remaining_name=row.get("remaining_name"),
-            last_name=row.get("last_name"),
-            birth_date=row.get("birth_date"),
-            email=row.get("email"),
-            social_url=row.get("social_url"),
-            nationality=row.get("nationality"),
-            document_ids=[],
-            created_at=row.get("created_at")
-        )
 
-
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Document:
     document_id: int | None = None
     title: str
@@ -118,13 +75,12 @@ class Document:
     tags: list[str]
     publisher: Publisher | None
     authors: list[Author] | None = None
-    created_at: datetime = datetime.now()
-
-    def get_parsed_dict(self) -> dict[str, Any]:
-        return asdict(self)
+    abstract: str | None = None
+    content_hash: str | None = None
+    created_at: datetime = field(default_factory=datetime.now)
 
 
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Book(Document):
     publication_place: str | None
     isbn: str | None
@@ -134,46 +90,30 @@ class Book(Document):
     def from_raw_data(self, data: dict) -> Self:
         """Create a new Book object from raw data"""
 
-        publisher: Publisher = Publisher.from_raw_data(data.get("publisher"))
+        publisher_data = csl.get_publisher(data)
+        publisher: Publisher | None = None
+        if publisher_data:
+            publisher = Publisher.from_raw_data(publisher_data)
 
         authors: list[Author] = []
-        for author in data.get("author"):
+        for author in csl.get_authors(data):
             authors.append(Author.from_raw_data(author))
 
         return Book(
             title=data.get("title"),
             language=data.get("language"),
-            year=int(data.get("issued").get("date-parts")[0][0]),
-            tags=[],
+            year=csl.get_year(data),
+            tags=csl.get_tags(data),
             publisher=publisher,
             authors=authors,
+            abstract=data.get("abstract"),
             publication_place=data.get("publisher-place"),
-            isbn=data.get("ISBN"),
+            isbn=csl.clean_isbn(data.get("ISBN")),
             edition=data.get("edition")
         )
 
-    @classmethod
-    def from_db_row(self, row: dict) -> Self:
-        """Create a new Book object from a database row"""
-
-        publisher: Publisher = Publisher.from_db_row(row)
 
-        return Book(
-            document_id=row.get("document_id"),
-            title=row.get("title"),
-            language=row.get("language"),
-            year=row.get("year"),
-            tags=[],
-            publisher=publisher,
-            authors=[],
-            publication_place=row.get("publication_place"),
-            isbn=row.get("isbn"),
-            edition=row.get("edition"),
-            created_at=row.get("doc_created_at")
-        )
-
-
-@dataclass(kw_only=True)
+@dataclass(kw_only=True, slots=True)
 class Paper(Document):
     journal: str | None
     volume: str | None
@@ -185,44 +125,49 @@ class Paper(Document):
     def from_raw_data(self, data: dict) -> Self:
         """Create a new Paper object from raw data"""
 
-        publisher: Publisher = Publisher.from_raw_data(data.get("publisher"))
+        publisher_data = csl.get_publisher(data)
+        publisher: Publisher | None = None
+        if publisher_data:
+            publisher = Publisher.from_raw_data(publisher_data)
 
         authors: list[Author] = []
-        for author in data.get("author"):
+        for author in csl.get_authors(data):
             authors.append(Author.from_raw_data(author))
 
         return Paper(
             title=data.get("title"),
             language=data.get("language"),
-            year=int(data.get("issued").get("date-parts")[0][0]),
-            tags=[],
+            year=csl.get_year(data),
+            tags=csl.get_tags(data),
             publisher=publisher,
             authors=authors,
+            abstract=data.get("abstract"),
             journal=data.get("container-title"),
             volume=data.get("volume"),
             issue=data.get("issue"),
             pages=data.get("page"),
-            doi=data.get("DOI")
+            doi=csl.clean_doi(data.get("DOI"))
         )
 
-    @classmethod
-    def from_db_row(self, row: dict) -> Self:
-        """Create a new Paper object from a database row"""
 
-        publisher: Publisher = Publisher.from_db_row(row)
+@dataclass(kw_only=True, slots=True)
+class SearchResult:
+    document: Document
+    rank: float
+    snippet: str
 
-        return Paper(
-            document_id=row.get("document_id"),
-            title=row.get("title"),
-            language=row.get("language"),
-            year=row.get("year"),
-            tags=[],
-            publisher=publisher,
-            authors=[],
-            journal=row.get("journal"),
-            volume=row.get("volume"),
-            issue=row.get("issue"),
-            pages=row.get("pages"),
-            doi=row.get("doi"),
-            created_at=row.get("doc_created_at")
-        )
+
+class DocumentTitle(NamedTuple):
+    document_id: int
+    title: str
+
+
+class AuthorName(NamedTuple):
+    author_id: int
+    last_name: str | None
+    remaining_name: str | None
+
+
+class PublisherName(NamedTuple):
+    publisher_id: int
+    name: str
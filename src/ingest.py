@@ -0,0 +1,36 @@
+import argparse
+from fsa.db.base import DatabaseConnector, PROFILES
+from fsa.db.handler import DBHandler
+from fsa.db.ingest import BulkIngestor
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Bulk import CSL-JSON exports into the archive")
+    parser.add_argument("paths", nargs="+", help="CSL-JSON files to import")
+    parser.add_argument("--user", default="admin",
+                        help="username that owns the imported documents")
+    parser.add_argument("--batch-size", type=int, default=5000,
+                        help="records written per transaction")
+    parser.add_argument("--profile", default="bulk-load",
+                        choices=sorted(PROFILES),
+                        help="SQLite performance profile for the import")
+    args = parser.parse_args()
+
+    DatabaseConnector.PROFILE = args.profile
+
+    with DatabaseConnector() as con:
+        handler = DBHandler(con)
+        try:
+            user = handler.get_user_by_username(args.user)
+        except ValueError:
+            parser.error(f"user '{args.user}' does not exist")
+
+        ingestor = BulkIngestor(con, user.user_id, args.batch_size)
+        for path in args.paths:
+            report = ingestor.ingest_file(path)
+            print(f"{path}: {report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,37 +1,24 @@
 import sys
-import json
 import time
 from fsa.db.base import DatabaseConnector
+from fsa.db.cache import EntityCache, QueryCache
 from fsa.db.handler import DBHandler
+from fsa.db.ingest import BulkIngestor
 from fsa.domain import Publisher, Book, Paper, Author, User
 
 
 def populate_books(user_id: int):
-    books = []
-    with open("src/fakedata/books.json", "r") as file:
-        raw_books = json.load(file)
-        for raw_book in raw_books:
-            books.append(Book.from_raw_data(raw_book))
-
-    for book in books:
-        print(f"{book.authors[0].last_name} - {book.title}")
-        with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            handler.insert_book(book, user_id)
+    with DatabaseConnector() as con:
+        ingestor = BulkIngestor(con, user_id)
+        report = ingestor.ingest_file("src/fakedata/books.json")
+    print(f"Books: {report}")
 
 
 def populate_papers(user_id: int):
-    papers = []
-    with open("src/fakedata/papers.json", "r") as file:
-        raw_papers = json.load(file)
-
-        for raw_paper in raw_papers:
-            papers.append(Paper.from_raw_data(raw_paper))
-
-    for paper in papers:
-        with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            handler.insert_paper(paper, user_id)
+    with DatabaseConnector() as con:
+        ingestor = BulkIngestor(con, user_id)
+        report = ingestor.ingest_file("src/fakedata/papers.json")
+    print(f"Papers: {report}")
 
 
 def check_go_back() -> None:
@@ -45,6 +32,8 @@ def check_go_back() -> None:
 class Application:
 
     logged_user: User | None = None
+    cache: EntityCache = EntityCache()
+    query_cache: QueryCache = QueryCache()
 
     def run(self) -> None:
         while True:
@@ -77,6 +66,8 @@ class Application:
                 print("18. Delete user")
                 print("19. Get Book by ID")
                 print("20. Get Paper by ID")
+                print("21. Search documents")
+                print("22. Show statistics")
                 print("100. Logout")
 
             print("0. Exit")
@@ -127,6 +118,10 @@ class Application:
                 self.get_book_by_id()
             elif option == "20":
                 self.get_paper_by_id()
+            elif option == "21":
+                self.search_documents()
+            elif option == "22":
+                self.show_statistics()
             elif option == "100":
                 self.logged_user = None
                 print(">> Logged out successfully.")
@@ -142,10 +137,10 @@ class Application:
         password = input("Password: ")
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             try:
                 user = handler.get_user_by_username(username)
-            except Exception:
+            except ValueError:
                 user = None
 
             if user is None or user.password != password:
@@ -157,7 +152,7 @@ class Application:
 
     def _login_as_admin(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             admin = handler.get_user_by_username("admin")
             self.logged_user = admin
 
@@ -173,7 +168,7 @@ class Application:
         )
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             handler.insert_user(user)
             print("User registered successfully.")
 
@@ -190,7 +185,7 @@ class Application:
         )
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             publisher_id = handler.insert_publisher(publisher)
             print("Publisher added successfully.")
 
@@ -215,7 +210,7 @@ class Application:
         )
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             author_id = handler.insert_author(author)
             print("Author added successfully.")
 
@@ -269,7 +264,7 @@ class Application:
             )
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
 
             if doc_type == "book":
                 document_id = handler.insert_book(document, user_id)
@@ -289,7 +284,7 @@ class Application:
             author_id = self.add_author()
             print(document_id, author_id)
             with DatabaseConnector() as con:
-                handler = DBHandler(con)
+                handler = DBHandler(con, self.cache, self.query_cache)
                 handler.link_author(author_id, document_id)
             add_authors = input("Add another author? (y/n): ")
 
@@ -301,12 +296,12 @@ class Application:
             return None
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             document_id = input("Document ID: ")
             print("\nSelected Document: ")
             print(handler.get_document_by_id(document_id).title)
 
-            authors = handler.get_authors()
+            authors = handler.list_author_names()
             print("\nFetching authors...")
             time.sleep(3)
 
@@ -323,7 +318,7 @@ class Application:
             return None
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             document_id = input("Document ID: ")
             print("\nSelected Document: ")
             try:
@@ -332,7 +327,7 @@ class Application:
                 print(">> Invalid document ID.")
                 return None
 
-            publishers = handler.get_publishers()
+            publishers = handler.list_publisher_names()
             print("\nFetching publishers...")
             time.sleep(3)
 
@@ -367,8 +362,8 @@ class Application:
 
     def update_book(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            books = handler.get_books()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            books = handler.list_document_titles("book")
             print("\nFetching books...")
             time.sleep(3)
 
@@ -400,8 +395,8 @@ class Application:
 
     def update_paper(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            papers = handler.get_papers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            papers = handler.list_document_titles("paper")
             print("\nFetching papers...")
             time.sleep(3)
 
@@ -437,8 +432,8 @@ class Application:
 
     def update_author(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            authors = handler.get_authors()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            authors = handler.list_author_names()
             print("\nFetching authors...")
             time.sleep(3)
 
@@ -471,8 +466,8 @@ class Application:
 
     def update_publisher(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            publishers = handler.get_publishers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            publishers = handler.list_publisher_names()
             print("\nFetching publishers...")
             time.sleep(3)
 
@@ -503,7 +498,7 @@ class Application:
 
         print(f"You are logged in as: {self.logged_user.username}")
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
 
             user = handler.get_user_by_username(self.logged_user.username)
 
@@ -544,8 +539,8 @@ class Application:
 
     def delete_book(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            books = handler.get_books()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            books = handler.list_document_titles("book")
             print("\nFetching books...")
             time.sleep(3)
 
@@ -563,8 +558,8 @@ class Application:
 
     def delete_paper(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            papers = handler.get_papers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            papers = handler.list_document_titles("paper")
             print("\nFetching papers...")
             time.sleep(3)
 
@@ -582,8 +577,8 @@ class Application:
 
     def delete_author(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            authors = handler.get_authors()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            authors = handler.list_author_names()
             print("\nFetching authors...")
             time.sleep(3)
 
@@ -602,8 +597,8 @@ class Application:
 
     def delete_publisher(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            publishers = handler.get_publishers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            publishers = handler.list_publisher_names()
             print("\nFetching publishers...")
             time.sleep(3)
 
@@ -626,7 +621,7 @@ class Application:
 
         print(f"You are logged in as: {self.logged_user.username}")
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
 
             confirm = input("Are you sure? (y/n) ")
             if confirm == "y":
@@ -643,16 +638,17 @@ class Application:
             return None
 
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             admin = handler.get_user_by_username("admin")
 
         populate_papers(admin.user_id)
         populate_books(admin.user_id)
+        self.cache.clear()
 
     def get_documents_by_author(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            authors = handler.get_authors()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            authors = handler.list_author_names()
             print("\nFetching authors...")
             time.sleep(3)
 
@@ -676,10 +672,43 @@ class Application:
 
             print("Documents fetched successfully.")
 
+    def search_documents(self) -> None:
+        query = input("Search: ")
+
+        with DatabaseConnector() as con:
+            handler = DBHandler(con, self.cache, self.query_cache)
+            results = handler.search(query)
+
+            print("\nResults: ")
+            for result in results:
+                print(f"{result.document.document_id}: {result.document.title}")
+                print(f"    {result.snippet}")
+
+        return check_go_back()
+
+    def show_statistics(self) -> None:
+        with DatabaseConnector() as con:
+            handler = DBHandler(con, self.cache, self.query_cache)
+            stats = handler.stats(limit=10)
+            publishers = {publisher.publisher_id: publisher.name
+                          for publisher in handler.list_publisher_names()}
+            authors = {author.author_id: f"{author.last_name}, "
+                       f"{author.remaining_name}"
+                       for author in handler.list_author_names()}
+
+            for dimension, counts in stats.items():
+                names = {"publisher": publishers, "author": authors}.get(
+                    dimension, {})
+                print(f"\nDocuments by {dimension}: ")
+                for value, count in counts.items():
+                    print(f"{names.get(value, value)}: {count}")
+
+        return check_go_back()
+
     def get_all_books(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            books = handler.get_books()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            books = handler.list_document_titles("book")
             print("\nFetching books...")
             time.sleep(3)
 
@@ -691,8 +720,8 @@ class Application:
 
     def get_all_papers(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            papers = handler.get_papers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            papers = handler.list_document_titles("paper")
             print("\nFetching papers...")
             time.sleep(3)
 
@@ -704,8 +733,8 @@ class Application:
 
     def get_all_publishers(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            publishers = handler.get_publishers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            publishers = handler.list_publisher_names()
             print("\nFetching publishers...")
             time.sleep(3)
 
@@ -717,8 +746,8 @@ class Application:
 
     def get_all_authors(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            authors = handler.get_authors()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            authors = handler.list_author_names()
             print("\nFetching authors...")
             time.sleep(3)
 
@@ -731,7 +760,7 @@ class Application:
 
     def get_all_users(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
+            handler = DBHandler(con, self.cache, self.query_cache)
             users = handler.get_users()
             print("\nFetching users...")
             time.sleep(3)
@@ -744,8 +773,8 @@ class Application:
 
     def get_book_by_id(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            books = handler.get_books()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            books = handler.list_document_titles("book")
             print("\nFetching books...")
             time.sleep(3)
 
@@ -777,8 +806,8 @@ class Application:
 
     def get_paper_by_id(self) -> None:
         with DatabaseConnector() as con:
-            handler = DBHandler(con)
-            papers = handler.get_papers()
+            handler = DBHandler(con, self.cache, self.query_cache)
+            papers = handler.list_document_titles("paper")
             print("\nFetching papers...")
             time.sleep(3)
 